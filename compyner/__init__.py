@@ -1,3 +1,4 @@
 from compyner.engine import ComPYner, ast_from_file
+from compyner.graph import ImportGraph, build_import_graph
 
-__all__ = ["ComPYner", "ast_from_file"]
+__all__ = ["ComPYner", "ast_from_file", "ImportGraph", "build_import_graph"]
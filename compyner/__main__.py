@@ -3,7 +3,10 @@ import sys
 from argparse import ArgumentParser
 from .logging import logger
 from pathlib import Path
-from compyner.engine import ComPYner
+from compyner.emitters import emitter_rules_from_profile, load_emitter_rules
+from compyner.engine import POOL_MIN_SIZE, STAGE_FORMATS, ComPYner
+from compyner.graph import build_import_graph
+from compyner.targets import TARGETS
 
 
 def file_path_exists(path: str) -> Path:
@@ -53,6 +56,15 @@ def main() -> None:
     parser.add_argument(
         "--exclude", required=False, action="store", type=str, default=None, nargs="+", help="Space-seperated list of modules not to include in the bundle"
     )
+    parser.add_argument(
+        "--target",
+        "-t",
+        required=False,
+        action="store",
+        type=str,
+        default=None,
+        help=f"Target environment whose modules are excluded automatically. One of {', '.join(TARGETS)} or a file listing one module per line."
+    )
     parser.add_argument(
         "--random-name-length",
         "-r",
@@ -62,12 +74,102 @@ def main() -> None:
         default=0,
         help="How long the generated random names should be. Use 0 for keeping the original names; use any negative number for incrementing. Default 0."
     )
+    parser.add_argument(
+        "--short-names",
+        required=False,
+        action="store_true",
+        help="Whether to rename generated names to the shortest free names, to save qstr memory in MicroPython."
+    )
     parser.add_argument(
         "--reduce-dunder-name",
         required=False,
         action="store_true",
         help="Whether not to set __name__ if it is not used in the file."
     )
+    parser.add_argument(
+        "--hoist-globals",
+        required=False,
+        action="store_true",
+        help="Whether to bind globals read inside loops to locals before the loop. Use @late_binding from compyner.typehints to opt out per function."
+    )
+    parser.add_argument(
+        "--emitters",
+        required=False,
+        action="store",
+        type=file_path_exists,
+        default=None,
+        help="File with module:function [native|viper] lines. Matching functions get @micropython.native or @micropython.viper."
+    )
+    parser.add_argument(
+        "--emitter-profile",
+        required=False,
+        action="store",
+        type=file_path_exists,
+        default=None,
+        help="cProfile output (python -m cProfile -o FILE). The functions with the most own time get @micropython.native."
+    )
+    parser.add_argument(
+        "--emitter-top",
+        required=False,
+        action="store",
+        type=int,
+        default=10,
+        help="How many functions of --emitter-profile to compile natively. Default 10."
+    )
+    parser.add_argument(
+        "--staged",
+        required=False,
+        action="store",
+        type=str,
+        nargs="?",
+        const="text",
+        default=None,
+        choices=STAGE_FORMATS,
+        help="Store every imported module as a separate string (text) or compressed blob (zlib) that is compiled and executed on its own, to lower the peak RAM use of compiling on the device."
+    )
+    parser.add_argument(
+        "--pool-constants",
+        required=False,
+        action="store",
+        type=int,
+        nargs="?",
+        const=POOL_MIN_SIZE,
+        default=None,
+        metavar="MIN_SIZE",
+        help=f"Whether to define repeated string and bytes constants of at least MIN_SIZE bytes (default {POOL_MIN_SIZE}) once and share them."
+    )
+    parser.add_argument(
+        "--graph",
+        required=False,
+        action="store",
+        type=file_path_valid,
+        default=None,
+        help="Write the import graph to this file, as DOT if it ends with .dot, JSON otherwise."
+    )
+    parser.add_argument(
+        "--pass",
+        required=False,
+        action="store",
+        type=str,
+        default=[],
+        nargs="+",
+        dest="passes",
+        help="Space-seperated list of installed passes (compyner.passes entry points) to run"
+    )
+    parser.add_argument(
+        "--timings",
+        required=False,
+        action="store_true",
+        help="Whether to log how long each pass took."
+    )
+    parser.add_argument(
+        "--cache",
+        required=False,
+        action="store",
+        type=Path,
+        default=None,
+        help="Directory to cache results in. The result is reused if no source, option or pass changed."
+    )
     args = parser.parse_args()
 
     if not args.output:
@@ -75,19 +177,69 @@ def main() -> None:
 
     module_ast = ast.parse(args.input.read_text(encoding="utf-8"))
 
+    emitters = []
+    if args.emitters:
+        emitters += load_emitter_rules(args.emitters)
+    if args.emitter_profile:
+        emitters += emitter_rules_from_profile(args.emitter_profile, args.emitter_top)
+
     compyner = ComPYner(
         exclude_modules=args.exclude,
+        target=args.target,
         require_dunder_name=not args.reduce_dunder_name,
         random_name_length=args.random_name_length,
         keep_names=not args.random_name_length,
+        hoist_globals=args.hoist_globals,
+        short_names=args.short_names,
+        emitters=emitters,
+        staged=args.staged,
+        pool_constants=args.pool_constants,
     )
-
-    logger.info("ComPYning...")
+    for name in args.passes:
+        compyner.pipeline.load_entry_point(name)
 
     sys.path.append(str(args.input.parent))
-    content = (
-        compyner.compyne_from_ast("__main__", module_ast, origin=args.input.name) + "\n"
-    )
+
+    logger.info("Planning imports...")
+    graph = build_import_graph(compyner, "__main__", module_ast, origin=args.input.name)
+    if args.graph:
+        logger.info("Writing import graph to %s...", args.graph)
+        args.graph.write_text(
+            graph.to_dot() if args.graph.suffix == ".dot" else graph.to_json(),
+            encoding="utf-8",
+        )
+    cycles = graph.cycles()
+    for cycle in cycles:
+        logger.error("Recursive import detected: %s", " > ".join(cycle))
+    if cycles:
+        sys.exit(1)
+
+    cached = None
+    if args.cache:
+        key = compyner.cache_key(
+            args.input.name,
+            args.input.read_text(encoding="utf-8"),
+            *(
+                name + "\0" + origin + "\0" + Path(origin).read_text(encoding="utf-8")
+                for name, origin in graph.origins.items()
+                if name != "__main__"
+            ),
+        )
+        cached = args.cache / f"{key}.py"
+
+    if cached and cached.exists():
+        logger.info("Nothing changed, using cached result %s...", cached)
+        content = cached.read_text(encoding="utf-8")
+    else:
+        logger.info("ComPYning...")
+        content = (
+            compyner.compyne_from_ast("__main__", module_ast, origin=args.input.name) + "\n"
+        )
+        if cached:
+            args.cache.mkdir(parents=True, exist_ok=True)
+            cached.write_text(content, encoding="utf-8")
+        if args.timings:
+            compyner.pipeline.log_timings()
 
     logger.info("Writing to %s...", args.output)
     args.output.write_text(
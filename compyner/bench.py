@@ -0,0 +1,320 @@
+"""
+Compare the runtime of a program with its comPYned bundle.
+
+Runs the original program (normal imports) and the bundle under CPython, and
+under the MicroPython unix port if it is installed, checks that both print the
+same output and reports timings for start-up, the import phase, the full run
+and user supplied micro-benchmarks (`module:function`).
+"""
+
+import contextlib
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import ast_comments as ast
+
+from .engine import POOL_MIN_SIZE, STAGE_FORMATS, ComPYner
+from .logging import logger
+from .targets import TARGETS
+
+CLOCK = """
+import time
+if hasattr(time, "perf_counter"):
+    bench_clock = time.perf_counter
+else:
+    def bench_clock():
+        return time.ticks_us() / 1000000
+"""
+
+IMPORT_DRIVER = CLOCK + """
+bench_start = bench_clock()
+{imports}
+print("BENCH", bench_clock() - bench_start)
+"""
+
+MICRO_DRIVER = CLOCK + """
+import {module}
+bench_start = bench_clock()
+for _ in range({number}):
+    {module}.{function}()
+print("BENCH", bench_clock() - bench_start)
+"""
+
+
+class ProgramFailed(Exception):
+    pass
+
+
+def run_program(interpreter: list[str], script: Path, cwd: Path, env: dict) -> tuple[float, str]:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [*interpreter, str(script)], cwd=cwd, env=env, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode:
+        raise ProgramFailed(f"{script.name} failed:\n{result.stderr.strip()}")
+    return elapsed, result.stdout
+
+
+def split_bench(output: str) -> tuple[float, str]:
+    # the last line of a driver is "BENCH <seconds>"
+    *lines, last = output.rstrip("\n").split("\n")
+    return float(last.split()[1]), "\n".join(lines)
+
+
+def compyne(source: str, project: Path, destination: Path, options: dict):
+    compyner = ComPYner(**options)
+    sys.path.append(str(project))
+    try:
+        with contextlib.chdir(project):
+            content = compyner.compyne_from_ast("__main__", ast.parse(source)) + "\n"
+    finally:
+        sys.path.remove(str(project))
+    destination.write_text(content, encoding="utf-8")
+
+
+def top_level_imports(source: str) -> str:
+    module = ast.parse(source)
+    return "\n".join(
+        ast.unparse(node)
+        for node in module.body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    )
+
+
+class Benchmark:
+    def __init__(self, entry: Path, options: dict, benchmarks=(), number=1000, repeat=5):
+        self.entry = entry.absolute()
+        self.project = self.entry.parent
+        self.options = options
+        self.benchmarks = benchmarks
+        self.number = number
+        self.repeat = repeat
+        self.rows = []
+        self.mismatches = []
+
+    def interpreters(self, micropython: str | None):
+        yield "cpython", [sys.executable], {
+            "PYTHONPATH": os.pathsep.join(
+                [str(self.project), *filter(None, [os.environ.get("PYTHONPATH")])]
+            )
+        }
+        micropython = micropython or shutil.which("micropython")
+        if micropython:
+            yield "micropython", [micropython], {
+                "MICROPYPATH": os.pathsep.join([str(self.project), ".frozen"])
+            }
+        else:
+            logger.warning("MicroPython not found, only benchmarking CPython.")
+
+    def best(self, interpreter, script, env, cwd, bench: bool) -> tuple[float, str]:
+        results = []
+        for _ in range(self.repeat):
+            elapsed, output = run_program(interpreter, script, cwd, env)
+            if bench:
+                elapsed, output = split_bench(output)
+            results.append((elapsed, output))
+        return min(results, key=lambda result: result[0])
+
+    def compare(self, name, phase, interpreter, env, original: Path, bundled: Path, bench: bool):
+        try:
+            original_time, original_output = self.best(
+                interpreter, original, env, self.project, bench
+            )
+        except ProgramFailed as e:
+            logger.warning("%s: original %s: %s", name, phase, e)
+            original_time, original_output = None, None
+        try:
+            bundled_time, bundled_output = self.best(
+                interpreter, bundled, env, self.project, bench
+            )
+        except ProgramFailed as e:
+            logger.error("%s: bundled %s: %s", name, phase, e)
+            self.mismatches.append((name, phase))
+            return
+        if original_output is not None and original_output != bundled_output:
+            logger.error("%s: %s prints different output when bundled", name, phase)
+            self.mismatches.append((name, phase))
+        self.rows.append((name, phase, original_time, bundled_time))
+
+    def run(self, micropython: str | None = None):
+        source = self.entry.read_text(encoding="utf-8")
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            drivers = [("full run", self.entry, source, False)]
+            drivers.append(
+                (
+                    "import phase",
+                    tmp / "imports.py",
+                    IMPORT_DRIVER.format(imports=top_level_imports(source)),
+                    True,
+                )
+            )
+            for benchmark in self.benchmarks:
+                module, function = benchmark.split(":")
+                drivers.append(
+                    (
+                        benchmark,
+                        tmp / f"bench_{len(drivers)}.py",
+                        MICRO_DRIVER.format(
+                            module=module, function=function, number=self.number
+                        ),
+                        True,
+                    )
+                )
+
+            options = {
+                **self.options,
+                "exclude_modules": [*(self.options.get("exclude_modules") or []), "time"],
+            }
+            bundles = []
+            for phase, original, driver_source, bench in drivers:
+                if original != self.entry:
+                    original.write_text(driver_source, encoding="utf-8")
+                bundled = tmp / f"{original.stem}.cpyd.py"
+                compyne(driver_source, self.project, bundled, options)
+                bundles.append((phase, original, bundled, bench))
+
+            empty = tmp / "empty.py"
+            empty.write_text("", encoding="utf-8")
+            for name, interpreter, env in self.interpreters(micropython):
+                env = {**os.environ, **env}
+                startup, _ = self.best(interpreter, empty, env, tmp, False)
+                self.rows.append((name, "start-up", startup, None))
+                for phase, original, bundled, bench in bundles:
+                    self.compare(name, phase, interpreter, env, original, bundled, bench)
+
+    def report(self) -> str:
+        lines = [f"{'interpreter':<12} {'phase':<24} {'original':>12} {'bundled':>12} {'ratio':>7}"]
+        for name, phase, original, bundled in self.rows:
+            ratio = f"{bundled / original:.2f}x" if original and bundled else ""
+            lines.append(
+                f"{name:<12} {phase:<24} {format_time(original):>12} {format_time(bundled):>12} {ratio:>7}"
+            )
+        return "\n".join(lines)
+
+
+def format_time(seconds: float | None) -> str:
+    if seconds is None:
+        return "-"
+    return f"{seconds * 1000:.3f} ms"
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Compare the runtime of a program with its comPYned bundle."
+    )
+    parser.add_argument("input", action="store", type=Path, help="Path to input file")
+    parser.add_argument(
+        "--bench",
+        "-b",
+        required=False,
+        action="store",
+        type=str,
+        default=[],
+        nargs="+",
+        help="Space-seperated list of module:function micro-benchmarks, called without arguments",
+    )
+    parser.add_argument(
+        "--number",
+        "-n",
+        required=False,
+        action="store",
+        type=int,
+        default=1000,
+        help="How often each micro-benchmark function is called per run. Default 1000.",
+    )
+    parser.add_argument(
+        "--repeat",
+        required=False,
+        action="store",
+        type=int,
+        default=5,
+        help="How often each program is run, the fastest run is reported. Default 5.",
+    )
+    parser.add_argument(
+        "--micropython",
+        required=False,
+        action="store",
+        type=str,
+        default=None,
+        help="Path to the MicroPython unix port. Defaults to micropython on the PATH.",
+    )
+    parser.add_argument(
+        "--exclude", required=False, action="store", type=str, default=None, nargs="+", help="Space-seperated list of modules not to include in the bundle"
+    )
+    parser.add_argument(
+        "--target",
+        "-t",
+        required=False,
+        action="store",
+        type=str,
+        default=None,
+        help=f"Target environment whose modules are excluded automatically. One of {', '.join(TARGETS)} or a file listing one module per line."
+    )
+    parser.add_argument(
+        "--hoist-globals",
+        required=False,
+        action="store_true",
+        help="Whether to bind globals read inside loops to locals before the loop."
+    )
+    parser.add_argument(
+        "--short-names",
+        required=False,
+        action="store_true",
+        help="Whether to rename generated names to the shortest free names."
+    )
+    parser.add_argument(
+        "--pool-constants",
+        required=False,
+        action="store",
+        type=int,
+        nargs="?",
+        const=POOL_MIN_SIZE,
+        default=None,
+        metavar="MIN_SIZE",
+        help=f"Whether to share repeated string and bytes constants of at least MIN_SIZE bytes (default {POOL_MIN_SIZE})."
+    )
+    parser.add_argument(
+        "--staged",
+        required=False,
+        action="store",
+        type=str,
+        nargs="?",
+        const="text",
+        default=None,
+        choices=STAGE_FORMATS,
+        help="Bundle with staged per-module compilation (text or zlib)."
+    )
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    benchmark = Benchmark(
+        args.input,
+        {
+            "exclude_modules": args.exclude,
+            "target": args.target,
+            "hoist_globals": args.hoist_globals,
+            "short_names": args.short_names,
+            "pool_constants": args.pool_constants,
+            "staged": args.staged,
+        },
+        benchmarks=args.bench,
+        number=args.number,
+        repeat=args.repeat,
+    )
+    benchmark.run(args.micropython)
+    print(benchmark.report())
+    if benchmark.mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Benchmark comPYning itself on generated worst-case programs.
+
+Builds a module with many statements, expressions nested deeper than the
+default recursion limit and a long chain of imports, and reports the build
+time and the peak memory allocated while building.
+"""
+
+import contextlib
+import logging
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from pathlib import Path
+
+import ast_comments as ast
+
+from .engine import ComPYner
+from .logging import logger
+
+
+def many_statements(count: int) -> dict[str, str]:
+    lines = ["total = 0"]
+    for i in range(count // 4):
+        lines.append(f"value_{i % 100} = {i}")
+        lines.append(f"def func_{i}(x):")
+        lines.append(f"    return x + value_{i % 100}")
+        lines.append(f"total += func_{i}(total) % 7")
+    lines.append("print(total)")
+    return {"main.py": "\n".join(lines) + "\n"}
+
+
+def deep_expressions(depth: int) -> dict[str, str]:
+    operands = " + ".join(["a"] * depth)
+    attributes = "x" + ".x" * depth
+    subscripts = "d" + "[0]" * depth
+    return {
+        "main.py": "\n".join(
+            [
+                "a = 1",
+                "class X:",
+                "    pass",
+                "x = X()",
+                "x.x = x",
+                "d = [0]",
+                "d[0] = d",
+                f"total = {operands}",
+                "def f(a):",
+                f"    return {operands}",
+                f"deep = {attributes}",
+                f"nested = {subscripts}",
+                "print(total, f(2), deep is x, nested is d)",
+            ]
+        )
+        + "\n"
+    }
+
+
+def import_chain(length: int) -> dict[str, str]:
+    files = {"main.py": "import chain_0\nprint(chain_0.DEPTH)\n"}
+    for i in range(length - 1):
+        files[f"chain_{i}.py"] = f"import chain_{i + 1}\nDEPTH = chain_{i + 1}.DEPTH + 1\n"
+    files[f"chain_{length - 1}.py"] = "DEPTH = 1\n"
+    return files
+
+
+def build(project: Path, options: dict) -> tuple[ComPYner, str]:
+    compyner = ComPYner(**options)
+    source = (project / "main.py").read_text(encoding="utf-8")
+    sys.path.append(str(project))
+    try:
+        with contextlib.chdir(project):
+            code = compyner.compyne_from_ast("__main__", ast.parse(source), origin="main.py")
+    finally:
+        sys.path.remove(str(project))
+        for name in [name for name in sys.modules if name.startswith("chain_")]:
+            del sys.modules[name]
+    return compyner, code
+
+
+def measure(files: dict[str, str], options: dict, repeat: int) -> tuple[float, int, ComPYner]:
+    with tempfile.TemporaryDirectory() as tmp:
+        project = Path(tmp)
+        for name, source in files.items():
+            (project / name).write_text(source, encoding="utf-8")
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            compyner, _ = build(project, options)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        tracemalloc.start()
+        try:
+            build(project, options)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return best, peak, compyner
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Benchmark comPYning generated worst-case programs.")
+    parser.add_argument(
+        "--statements",
+        required=False,
+        action="store",
+        type=int,
+        default=100000,
+        help="Number of statements of the large module. Default 100000.",
+    )
+    parser.add_argument(
+        "--depth",
+        required=False,
+        action="store",
+        type=int,
+        default=1500,
+        help="Nesting depth of the deep expressions. Default 1500.",
+    )
+    parser.add_argument(
+        "--chain",
+        required=False,
+        action="store",
+        type=int,
+        default=200,
+        help="Number of modules importing each other in a chain. Default 200.",
+    )
+    parser.add_argument(
+        "--repeat",
+        required=False,
+        action="store",
+        type=int,
+        default=3,
+        help="How often each program is built, the fastest build is reported. Default 3.",
+    )
+    parser.add_argument(
+        "--timings",
+        required=False,
+        action="store_true",
+        help="Whether to log how long each pass took.",
+    )
+    args = parser.parse_args()
+
+    logger.setLevel(logging.INFO if args.timings else logging.WARNING)
+    scenarios = [
+        (f"{args.statements} statements", many_statements(args.statements)),
+        (f"nesting depth {args.depth}", deep_expressions(args.depth)),
+        (f"import chain of {args.chain}", import_chain(args.chain)),
+    ]
+    print(f"{'program':<28} {'build':>12} {'peak memory':>14}")
+    for name, files in scenarios:
+        try:
+            elapsed, peak, compyner = measure(files, {}, args.repeat)
+        except RecursionError as e:
+            print(f"{name:<28} {'RecursionError':>12}  {e}")
+            continue
+        print(f"{name:<28} {elapsed * 1000:>9.1f} ms {peak / 1024 / 1024:>11.1f} MB")
+        if args.timings:
+            compyner.pipeline.log_timings()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import ast
+import pstats
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import NamedTuple
+
+from .logging import logger
+
+EMITTERS = ("native", "viper")
+# emitters to try, in order, when a function asks for one
+FALLBACKS = {"viper": ("viper", "native"), "native": ("native",)}
+
+
+class EmitterRule(NamedTuple):
+    module: str
+    function: str
+    emitter: str
+    # set for rules from a profile, matched instead of the patterns
+    path: str | None = None
+    lineno: int | None = None
+
+    def matches(self, module: str, qualname: str, path: str, lineno: int) -> bool:
+        if self.path is not None:
+            return self.path == path and self.lineno == lineno
+        return fnmatchcase(module, self.module) and fnmatchcase(qualname, self.function)
+
+
+def load_emitter_rules(file: Path) -> list[EmitterRule]:
+    """
+    Read rules of the form `module:function [native|viper]`, patterns may use wildcards.
+    """
+    rules = []
+    for line in file.read_text(encoding="utf-8").splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        target, _, emitter = line.partition(" ")
+        emitter = emitter.strip() or "native"
+        if emitter not in EMITTERS or ":" not in target:
+            raise ValueError(f"Invalid emitter rule in {file}: {line}")
+        module, function = target.split(":", 1)
+        rules.append(EmitterRule(module, function, emitter))
+    return rules
+
+
+def emitter_rules_from_profile(file: Path, top: int, emitter: str = "native") -> list[EmitterRule]:
+    """
+    Select the `top` functions with the most own time from a cProfile/pstats file.
+    """
+    stats = pstats.Stats(str(file)).stats
+    hottest = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)
+    rules = []
+    for (filename, lineno, function), _ in hottest:
+        path = Path(filename).absolute()
+        # only functions of files that can be bundled
+        if not path.is_file() or not path.is_relative_to(Path.cwd()):
+            continue
+        rules.append(
+            EmitterRule(
+                "*", function, emitter, path.relative_to(Path.cwd()).as_posix(), lineno
+            )
+        )
+        if len(rules) == top:
+            break
+    return rules
+
+
+def unsupported_construct(node: ast.FunctionDef, emitter: str) -> str | None:
+    # constructs the MicroPython emitters can't compile, nested functions inherit the emitter
+    if isinstance(node, ast.AsyncFunctionDef):
+        return "async functions"
+    for subnode in ast.walk(node):
+        match subnode:
+            case ast.With() | ast.AsyncWith():
+                return "context managers"
+            case ast.Yield() | ast.YieldFrom():
+                return "generators"
+            case ast.AsyncFunctionDef() | ast.Await():
+                return "async functions"
+            case ast.Raise(exc=None):
+                return "raise without an exception"
+    if emitter == "viper":
+        args = node.args
+        if args.vararg or args.kwarg or args.kwonlyargs:
+            return "*args, **kwargs or keyword-only arguments"
+        if args.defaults:
+            return "default argument values"
+        if len(args.posonlyargs) + len(args.args) > 4:
+            return "more than four arguments"
+    return None
+
+
+def choose_emitter(node: ast.FunctionDef, emitter: str, where: str) -> str | None:
+    for candidate in FALLBACKS[emitter]:
+        reason = unsupported_construct(node, candidate)
+        if reason is None:
+            return candidate
+        logger.warning(
+            "%s cannot use the %s emitter, it uses %s.", where, candidate, reason
+        )
+    return None
+
+
+def is_emitter_decorator(node: ast.expr) -> bool:
+    match node:
+        case ast.Attribute(ast.Name("micropython"), attr) if attr in EMITTERS:
+            return True
+    return False
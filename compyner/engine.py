@@ -1,5 +1,13 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+import builtins
+import contextlib
+import functools
+import gc
+import hashlib
+import itertools
+import keyword
 import ast_comments as ast
+import importlib.metadata
 import importlib.util
 from pathlib import Path
 import re
@@ -7,14 +15,69 @@ import sys
 from .logging import logger
 import random
 import string
+import sysconfig
+import zlib
+from .emitters import choose_emitter, is_emitter_decorator
+from .passes import ModuleUnit, Pass, Pipeline, callable_key
+from .targets import load_target
+
+
+class Emit(ast.AST):
+    """
+    A generated statement that is written as text instead of being unparsed.
+
+    The statement is `template.format(*args)`, args are the identifiers used in it.
+    """
+
+    _fields = ("template", "args")
+
+
+class Stage(ast.stmt):
+    """
+    A module that is compiled and executed on its own by the staged loader.
+
+    Unparsed as `call`, the body is stored in the stage table, see ComPYner(staged=...).
+    """
+
+    _fields = ("name", "index", "call", "body")
 
 
 class NoneFriendlyUnparser(ast._Unparser):
+    def __init__(self):
+        super().__init__()
+        self._visitors = {}
+
     def generic_visit(self, node):
         if node is None:
             return
         return super().generic_visit(node)
 
+    def traverse(self, node):
+        # same as _Unparser.traverse, with the visitor lookup cached per node type
+        if isinstance(node, list):
+            for item in node:
+                self.traverse(item)
+            return
+        try:
+            visitor = self._visitors[node.__class__]
+        except KeyError:
+            visitor = self._visitors[node.__class__] = getattr(
+                self, "visit_" + node.__class__.__name__, self.generic_visit
+            )
+        visitor(node)
+
+    def visit_Emit(self, node: Emit):
+        self.fill(node.template.format(*node.args))
+
+    def visit_Stage(self, node: Stage):
+        self.traverse(node.call)
+
+
+class CompactUnparser(NoneFriendlyUnparser):
+    # stages are kept in RAM until they are compiled, leave out the location comments
+    def visit_Comment(self, node):
+        pass
+
 
 def name_replacement(
     gr: "TransformGlobals", name: str, original_node: ast.AST, ctx: ast.expr_context
@@ -30,6 +93,107 @@ def name_replacement(
     return attr
 
 
+def walk_children(root: ast.AST, visit) -> ast.AST:
+    """
+    Visit the nodes below root depth first and in order, using an explicit stack instead of recursion.
+
+    `visit(node)` returns the node to put in its place and whether to continue
+    into it, so expressions can be nested deeper than the recursion limit.
+    """
+    stack = child_slots(root)
+    while stack:
+        parent, field, index = stack.pop()
+        if index is None:
+            node, descend = visit(getattr(parent, field))
+            setattr(parent, field, node)
+        else:
+            nodes = getattr(parent, field)
+            node, descend = visit(nodes[index])
+            nodes[index] = node
+        if descend:
+            stack.extend(child_slots(node))
+    return root
+
+
+def child_slots(node: ast.AST) -> list[tuple[ast.AST, str, int | None]]:
+    # (parent, field, index in the list or None), last child first to pop them in order
+    slots = []
+    for field, value in ast.iter_fields(node):
+        if isinstance(value, list):
+            slots.extend(
+                (node, field, index) for index, item in enumerate(value) if isinstance(item, ast.AST)
+            )
+        elif isinstance(value, ast.AST):
+            slots.append((node, field, None))
+    slots.reverse()
+    return slots
+
+
+class IterativeVisitor(ast.NodeVisitor):
+    """
+    NodeVisitor that walks nodes without a visit_ method using walk_children.
+
+    Only nodes with their own visitor use a stack frame, nodes are still visited in order.
+    """
+
+    def generic_visit(self, node):
+        walk_children(node, self.visit_child)
+
+    def visit_child(self, node: ast.AST) -> tuple[ast.AST, bool]:
+        visitor = getattr(self, "visit_" + node.__class__.__name__, None)
+        if visitor is None:
+            return node, True
+        visitor(node)
+        return node, False
+
+
+# Python to Python calls don't use the C stack and C recursion is limited
+# separately (Python >= 3.12), so a high limit can't crash the interpreter
+DEEP_RECURSION_LIMIT = 50000
+
+
+@contextlib.contextmanager
+def recursion_limit(limit: int = DEEP_RECURSION_LIMIT):
+    # the unparser and nested imports recurse, deep programs need more than the default 1000
+    old_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(old_limit, limit))
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(old_limit)
+
+
+@contextlib.contextmanager
+def fewer_collections(threshold: int = 100000):
+    # builds allocate millions of (acyclic) AST nodes, collecting every 2000 allocations
+    # takes as long as the build itself for large programs
+    old_threshold = gc.get_threshold()
+    gc.set_threshold(max(old_threshold[0], threshold), *old_threshold[1:])
+    try:
+        yield
+    finally:
+        gc.set_threshold(*old_threshold)
+
+
+def attribute_chain(node: ast.AST) -> tuple[str, ...] | None:
+    # a.b.c => ("a", "b", "c"); None if the chain is not rooted at a plain name
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return tuple(reversed(parts))
+
+
+def chain_to_ast(chain: tuple[str, ...], original_node: ast.AST) -> ast.expr:
+    node = ast.Name(chain[0], ast.Load())
+    for attr in chain[1:]:
+        node = ast.Attribute(node, attr, ast.Load())
+    return ast.copy_location(node, original_node)
+
+
 def ast_from_file(file_path: Path) -> ast.Module:
     with file_path.open(encoding="utf-8") as f:
         code = f.read()
@@ -40,7 +204,20 @@ def path_from_module(module: str) -> Path:
     return Path(importlib.util.find_spec(module).origin)
 
 
+def is_host_stdlib(origin: str) -> bool:
+    path = Path(origin).resolve()
+    stdlib = Path(sysconfig.get_path("stdlib")).resolve()
+    site_packages = {
+        Path(sysconfig.get_path("purelib")).resolve(),
+        Path(sysconfig.get_path("platlib")).resolve(),
+    }
+    return path.is_relative_to(stdlib) and not any(
+        path.is_relative_to(site) for site in site_packages
+    )
+
+
 MODULE_CLASS_BODY = ast_from_file(path_from_module("compyner.snippets.module"))
+LAZY_MODULES_CLASS_BODY = ast_from_file(path_from_module("compyner.snippets.lazy_modules"))
 
 def pyobj_to_ast(pyobj: int | float | str | tuple | list | dict | set | bool | None) -> ast.AST:
     if isinstance(pyobj, int | float | str | bool | None):
@@ -61,6 +238,148 @@ def pyobj_to_ast(pyobj: int | float | str | tuple | list | dict | set | bool | N
     raise TypeError("unsupported type", type(pyobj))
 
 
+def is_compile_time(node: ast.AST) -> bool:
+    # @compile functions run on the host while bundling, their body is never bundled
+    match node:
+        case ast.FunctionDef(decorator_list=[ast.Name(id="compile")]):
+            return True
+    return False
+
+
+def not_bundlable(spec) -> str | None:
+    # why a found module can't be bundled, None if it can
+    if spec.origin == "built-in":
+        return "It is a built-in module"
+    if not spec.has_location:
+        return "It does not have a location"
+    if not spec.origin.endswith(".py"):
+        return "It is not a python source file"
+    return None
+
+
+def project_path() -> Path:
+    # the input file's directory is appended to sys.path last
+    return Path(sys.path[-1]).absolute()
+
+
+def glob_import_specs(glob: str) -> list:
+    # __glob_import__ globs relative to the input file's directory
+    path = project_path()
+    return [
+        importlib.util.spec_from_file_location(file.with_suffix("").name, file)
+        for file in (file.absolute() for file in path.glob(glob))
+    ]
+
+
+def module_metadata(module: ast.Module) -> dict:
+    # top-level UPPER_CASE constants, readable without initializing a lazy module
+    metadata = {}
+    for node in module.body:
+        match node:
+            case ast.Assign(targets=[ast.Name(id=name)], value=value) | ast.AnnAssign(
+                target=ast.Name(id=name), value=value
+            ) if value is not None and name.isupper():
+                try:
+                    value = ast.literal_eval(value)
+                    pyobj_to_ast(value)
+                except (ValueError, TypeError):
+                    continue
+                metadata[name] = value
+    return metadata
+
+
+def lazy_modules_class_def(name: str) -> ast.ClassDef:
+    return ast.ClassDef(
+        name=name,
+        bases=[],
+        keywords=[],
+        body=[*(LAZY_MODULES_CLASS_BODY).body],
+        decorator_list=[],
+        lineno=0,
+        col_offset=0,
+        end_lineno=0,
+        end_col_offset=0,
+    )
+
+
+def module_class_def(name: str) -> ast.ClassDef:
+    return ast.ClassDef(
+        name=name,
+        bases=[ast.Name("dict", ast.Load())],
+        keywords=[],
+        body=[*(MODULE_CLASS_BODY).body],
+        decorator_list=[],
+        lineno=0,
+        col_offset=0,
+        end_lineno=0,
+        end_col_offset=0,
+    )
+
+
+STAGE_FORMATS = ("text", "zlib")
+
+STAGE_LOADER = """
+def {loader}(index):
+    import gc
+    name, code = {table}[index]
+    code = compile({source}, name, "exec")
+    gc.collect()
+    exec(code, globals())
+"""
+
+STAGE_INFLATE = """
+def {inflate}(data):
+    try:
+        import deflate, io
+        return deflate.DeflateIO(io.BytesIO(data), deflate.ZLIB).read().decode()
+    except ImportError:
+        import zlib
+        return zlib.decompress(data).decode()
+"""
+
+
+def stage_loader(compyner: "ComPYner") -> tuple[Emit, list[ast.stmt]]:
+    # names are generated so short-names can rename them like everything else
+    if compyner.staged == "zlib":
+        inflate = compyner.namer.get_unique_name("inflate")
+        source = STAGE_INFLATE.format(inflate=inflate) + STAGE_LOADER.format(
+            loader=compyner.stage_loader, table=compyner.stage_table, source=f"{inflate}(code)"
+        )
+    else:
+        source = STAGE_LOADER.format(
+            loader=compyner.stage_loader, table=compyner.stage_table, source="code"
+        )
+    # the table is filled in by render_stages once the program is final
+    table = Emit("{} = {}", (compyner.stage_table, "[]"))
+    return table, [
+        compyner.set_file("<comPYner stage loader>"),
+        table,
+        *ast.parse(source).body,
+    ]
+
+
+def render_stages(program: ast.Module, stage_format: str) -> str:
+    # every stage is unparsed on its own, nested stages become loader calls
+    stages = sorted(
+        (node for node in ast.walk(program) if isinstance(node, Stage)),
+        key=lambda stage: stage.index,
+    )
+    entries = []
+    for stage in stages:
+        source = CompactUnparser().visit(ast.Module(stage.body, [])).strip()
+        if stage_format == "zlib":
+            entries.append(repr((stage.name, zlib.compress(source.encode(), 9))))
+        else:
+            entries.append(repr((stage.name, source)))
+    return "[\n    " + ",\n    ".join(entries) + ",\n]" if entries else "[]"
+
+
+@functools.cache
+def module_class_source(name: str) -> str:
+    # the Module class never changes, render it once per name
+    return NoneFriendlyUnparser().visit(module_class_def(name))
+
+
 class CompileTimeReplacements:
     @staticmethod
     def glob_import(
@@ -74,15 +393,10 @@ class CompileTimeReplacements:
                 "The first argument of import_regex must be a constant.", args[0]
             )
         glob = args[0].value
-        path = Path(sys.path[-1]).absolute()
-        files = [file.absolute() for file in path.glob(glob)]
-        names = [file.with_suffix("").name for file in files]
         prefix = []
         elts = []
-        for name, file in zip(names, files):
-            spec = importlib.util.spec_from_file_location(
-                file.with_suffix("").name, file
-            )
+        for spec in glob_import_specs(glob):
+            name, file = spec.name, Path(spec.origin)
             do, code = replacer.compyner.import_module_from_spec(spec, spec.name)
             prefix.extend(code)
             if do is False:
@@ -100,6 +414,55 @@ class CompileTimeReplacements:
             elts=elts,
             ctx=ast.Load(),
         )
+
+    @staticmethod
+    def lazy_glob_import(
+        replacer: "TransformGlobals", node: ast.Call, /
+    ) -> tuple[list[ast.AST], ast.AST]:
+        args = [replacer.visit(arg) for arg in node.args]
+        if len(args) != 1:
+            raise ValueError("Lazy import regex takes exactly one argument", args)
+        if not isinstance(args[0], ast.Constant):
+            raise TypeError(
+                "The first argument of __lazy_glob_import__ must be a constant.", args[0]
+            )
+        compyner = replacer.compyner
+        glob = args[0].value
+        loaders = {}
+        metadata = {}
+        # modules first bundled here get their own loaders, see ComPYner.lazy_loader
+        compyner.lazy_registries += 1
+        try:
+            for spec in glob_import_specs(glob):
+                name, file = spec.name, Path(spec.origin)
+                do, _ = compyner.import_module_from_spec(spec, spec.name)
+                if do is False:
+                    raise ValueError(
+                        f"Could not import module {file.relative_to(Path.cwd())} using glob."
+                    )
+                if name in compyner.lazy_modules:
+                    loaders[name] = ast.Name(compyner.lazy_modules[name], ast.Load())
+                else:
+                    # initialized already by a normal import
+                    loaders[name] = ast.Lambda(
+                        ast.arguments([], [], None, [], [], None, []),
+                        ast.Name(compyner.names_for_modules[name], ast.Load()),
+                    )
+                metadata[name] = module_metadata(ast_from_file(file))
+        finally:
+            compyner.lazy_registries -= 1
+
+        return [], ast.Call(
+            ast.Name(compyner.lazy_modules_class(), ast.Load()),
+            [
+                ast.Dict(
+                    [ast.Constant(name) for name in loaders],
+                    list(loaders.values()),
+                ),
+                pyobj_to_ast(metadata),
+            ],
+            [],
+        )
         
     @staticmethod
     def at_compile(
@@ -120,16 +483,27 @@ class CompileTimeReplacements:
         return pyobj_to_ast(gs.get("result"))
 
 
-class DiscoverGlobals(ast.NodeVisitor):
+def is_glob_import(node: ast.stmt) -> bool:
+    match node:
+        case ast.Assign(
+            value=ast.Call(func=ast.Name(id="__glob_import__" | "__lazy_glob_import__"))
+        ):
+            return True
+    return False
+
+
+class DiscoverGlobals(IterativeVisitor):
     def __init__(self, explicit_only=False, context=None):
         super().__init__()
         self.globals = []
         self.explicit_only = explicit_only
         self.context = context or []
         self.has_dunder_name = False
+        self.seen = set()
 
     def add(self, name):
-        if name not in self.globals:
+        if name not in self.seen:
+            self.seen.add(name)
             self.globals.append((name, self.context))
 
     def visit_Name(self, node: ast.Name):
@@ -199,14 +573,22 @@ class TransformGlobals(ast.NodeTransformer):
         parent: str = None,
         context=None,
         tmp_self=None,
+        module: str = None,
     ):
         super().__init__()
-        self.globals = globals_
+        # (name, scope) pairs, looked up for every name in the module
+        self.globals = (
+            globals_
+            if isinstance(globals_, (set, frozenset))
+            else {(name, tuple(context)) for name, context in globals_}
+        )
         self.compyner = compyner
         self.pulled_from_air_modules = []
         self.parent = parent
         self.context = context or []
+        self.scope = tuple(self.context)
         self.tmp_self = tmp_self or "_comPYned_SELF"
+        self.module = module
 
     def set_line(self, line):
         return self.compyner.set_line(line)
@@ -214,13 +596,19 @@ class TransformGlobals(ast.NodeTransformer):
     def is_name_global(self, name, readonly):
         # check whether name is a global variable
         name = name.split(".")[0]
-        ctx = self.context.copy()
+        ctx = self.scope
         while ctx and readonly:
             if (name, ctx) in self.globals:
                 return True
             ctx = ctx[:-1]
         return (name, ctx) in self.globals
 
+    def emit_assign(self, name: str, glob: bool, template: str, *args) -> Emit:
+        # same target as name_replacement, but written directly
+        if glob and name not in (self.compyner.module_class_name, "ComPYnerBuildTools"):
+            return Emit("{}.{} = " + template, (self.tmp_self, name, *args))
+        return Emit("{} = " + template, (name, *args))
+
     def visit_Name(self, node):
         # replace names if global
         if self.is_name_global(node.id, readonly=isinstance(node.ctx, ast.Load)):
@@ -233,24 +621,39 @@ class TransformGlobals(ast.NodeTransformer):
         return ast.Pass()
 
     def visit_FunctionDef(self, node: ast.FunctionDef):
-        match node:
-            case ast.FunctionDef(
-                decorator_list=[ast.Name(id="compile")]
-            ):
-                val = CompileTimeReplacements.at_compile(self, node)
-                return [
-                    ast.copy_location(ast.Assign(targets=[self.visit(ast.Name(node.name, ast.Store()))], value=val), node)
-                ]
-        
+        if is_compile_time(node):
+            val = CompileTimeReplacements.at_compile(self, node)
+            return [
+                ast.copy_location(ast.Assign(targets=[self.visit(ast.Name(node.name, ast.Store()))], value=val), node)
+            ]
+
+        emitter = self.compyner.emitter_for(self.module, self.context + [node.name], node)
+
+        # @late_binding is dropped, HoistGlobals skips the function
+        decorators = [
+            n
+            for n in node.decorator_list
+            if not (isinstance(n, ast.Name) and n.id == "late_binding")
+        ]
+        if len(decorators) != len(node.decorator_list):
+            node.decorator_list = decorators
+            self.compyner.late_binding.add(node)
+
         sub_replacer = TransformGlobals(
             self.compyner,
             self.globals,
             self.parent,
             self.context + [node.name],
             self.tmp_self,
+            self.module,
         )
-        node.body = [sub_replacer.visit(n) for n in node.body]
+        node.body = sub_replacer.transform_nodes(node.body)
         node.decorator_list = [self.visit(n) for n in node.decorator_list]
+        if emitter:
+            # built-in decorator, resolved by the MicroPython compiler without an import
+            node.decorator_list.insert(
+                0, ast.Attribute(ast.Name("micropython", ast.Load()), emitter, ast.Load())
+            )
         node.args = self.visit(node.args) if node.args else None
 
         if node.returns is not None:
@@ -270,21 +673,15 @@ class TransformGlobals(ast.NodeTransformer):
             self.set_line(node.lineno),
             node,
             # reassign and delete temp var
-            ast.copy_location(
-                ast.Assign(
-                    targets=[name_replacement(self, original_name, node, ast.Store())],
-                    value=ast.Name(id=node.name, ctx=ast.Load()),
-                ),
-                node,
-            ),
-            ast.copy_location(
-                ast.Delete(
-                    [ast.Name(id=node.name, ctx=ast.Del())],
-                ),
-                node,
-            ),
+            self.emit_assign(original_name, True, "{}", node.name),
+            Emit("del {}", (node.name,)),
         ]
 
+    def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef):
+        # the emitters can't compile async functions, warn if a rule selects one
+        self.compyner.emitter_for(self.module, self.context + [node.name], node)
+        return self.generic_visit(node)
+
     def visit_ClassDef(self, node: ast.ClassDef):
         sub_replacer = TransformGlobals(
             self.compyner,
@@ -292,8 +689,9 @@ class TransformGlobals(ast.NodeTransformer):
             self.parent,
             self.context + [node.name],
             self.tmp_self,
+            self.module,
         )
-        node.body = [sub_replacer.visit(n) for n in node.body]
+        node.body = sub_replacer.transform_nodes(node.body)
         node.bases = [self.visit(n) for n in node.bases]
 
         if not self.is_name_global(node.name, False):
@@ -310,19 +708,8 @@ class TransformGlobals(ast.NodeTransformer):
             self.set_line(node.lineno),
             node,
             # reassign and delete temp var
-            ast.copy_location(
-                ast.Assign(
-                    targets=[name_replacement(self, original_name, node, ast.Store())],
-                    value=ast.Name(id=node.name, ctx=ast.Load()),
-                ),
-                node,
-            ),
-            ast.copy_location(
-                ast.Delete(
-                    [ast.Name(id=node.name, ctx=ast.Del())],
-                ),
-                node,
-            ),
+            self.emit_assign(original_name, True, "{}", node.name),
+            Emit("del {}", (node.name,)),
         ]
 
     def visit_Import(self, node: ast.Import):
@@ -338,53 +725,15 @@ class TransformGlobals(ast.NodeTransformer):
                     continue
                 self.pulled_from_air_modules.append(pname)
                 new_imports.append(
-                    ast.copy_location(
-                        ast.Assign(
-                            targets=[
-                                name_replacement(
-                                    self,
-                                    pname,
-                                    alias,
-                                    ast.Store(),
-                                )
-                            ],
-                            value=ast.Call(
-                                (ast.Name(self.compyner.module_class_name, ast.Load())),
-                                [],
-                                [],
-                            ),
-                            ),
-                        node,
-                    )
+                    self.emit_assign(pname, True, "{}()", self.compyner.module_class_name)
                 )
             if replace_import:
                 new_imports.append(
-                    ast.copy_location(
-                        ast.Assign(
-                            targets=[
-                                (
-                                    name_replacement(
-                                        self,
-                                        alias.asname or alias.name,
-                                        alias,
-                                        ast.Store(),
-                                    )
-                                    if glob
-                                    else ast.copy_location(
-                                        ast.Name(
-                                            alias.asname or alias.name, ast.Store()
-                                        ),
-                                        alias,
-                                    )
-                                )
-                            ],
-                            value=(
-                                ast.Name(
-                                    self.compyner.names_for_modules[replace_import]
-                                )
-                            ),
-                        ),
-                        node,
+                    self.emit_assign(
+                        alias.asname or alias.name,
+                        glob,
+                        "{}",
+                        self.compyner.names_for_modules[replace_import],
                     )
                 )
             else:
@@ -393,40 +742,14 @@ class TransformGlobals(ast.NodeTransformer):
                 ) or self.compyner.namer.get_unique_name(
                     "import_" + (alias.asname or alias.name)
                 )
-                new_imports.append(
-                    ast.copy_location(
-                        ast.Import([ast.alias(alias.name, tmp_name)]), node
-                    )
-                )
+                new_imports.append(Emit("import {} as {}", (alias.name, tmp_name)))
                 if alias.asname != tmp_name:
                     new_imports.append(
-                        ast.copy_location(
-                            ast.Assign(
-                                [
-                                    (
-                                        name_replacement(
-                                            self,
-                                            alias.asname or alias.name,
-                                            alias,
-                                            ast.Store(),
-                                        )
-                                        if glob
-                                        else ast.copy_location(
-                                            ast.Name(
-                                                alias.asname or alias.name, ast.Store()
-                                            ),
-                                            node,
-                                        )
-                                    )
-                                ],
-                                ast.Name(tmp_name, ast.Load()),
-                            ),
-                            node,
-                        )
+                        self.emit_assign(alias.asname or alias.name, glob, "{}", tmp_name)
                     )
         return [
             self.set_line(node.lineno),
-            new_imports,
+            *new_imports,
         ]
 
     # def visit_Call(self, node: ast.Call):
@@ -481,7 +804,7 @@ class TransformGlobals(ast.NodeTransformer):
         new_imports = []
         # import parent module as tmp_name
         tmp_module = self.compyner.namer.get_unique_name("import_" + node.module)
-        new_imports.append(
+        new_imports.extend(
             self.visit_Import(
                 ast.copy_location(
                     ast.Import(
@@ -498,30 +821,8 @@ class TransformGlobals(ast.NodeTransformer):
         for alias in node.names:
             glob = self.is_name_global(alias.asname or alias.name, False)
             new_imports.append(
-                ast.copy_location(
-                    ast.Assign(
-                        targets=[
-                            (
-                                name_replacement(
-                                    self,
-                                    alias.asname or alias.name,
-                                    alias,
-                                    ast.Store(),
-                                )
-                                if glob
-                                else ast.copy_location(
-                                    ast.Name(alias.asname or alias.name, ast.Store()),
-                                    alias,
-                                )
-                            )
-                        ],
-                        value=ast.Attribute(
-                            ast.Name(tmp_module, ast.Load()),
-                            alias.name,
-                            ast.Load(),
-                        ),
-                    ),
-                    alias,
+                self.emit_assign(
+                    alias.asname or alias.name, glob, "{}.{}", tmp_module, alias.name
                 )
             )
         return new_imports
@@ -550,18 +851,323 @@ class TransformGlobals(ast.NodeTransformer):
                 return prefix + [
                     ast.copy_location(ast.Assign(targets=[self.visit(target) for target in node.targets], value=val), node)
                 ]
+            case ast.Assign(
+                value=ast.Call(
+                    func=ast.Name(id="__lazy_glob_import__"),
+                    args=[ast.Constant()],
+                )
+            ):
+                prefix, val = CompileTimeReplacements.lazy_glob_import(self, node.value)
+                return prefix + [
+                    ast.copy_location(ast.Assign(targets=[self.visit(target) for target in node.targets], value=val), node)
+                ]
 
         # Add lineno to statements
         if isinstance(node, ast.stmt):
-            subnodes = super().generic_visit(node)
-            if isinstance(subnodes, list):
-                return [self.set_line(node.lineno), *subnodes]
-            return [
-                self.set_line(node.lineno),
-                subnodes,
-            ]
+            return [self.set_line(node.lineno), self.transform_fields(node)]
+        # expressions can be nested deeper than the recursion limit
+        if isinstance(node, ast.expr):
+            return walk_children(node, self.replace_name)
+        return self.transform_fields(node)
+
+    def replace_name(self, node: ast.AST) -> tuple[ast.AST, bool]:
+        if isinstance(node, ast.Name):
+            return self.visit_Name(node), False
+        return node, True
+
+    def transform_fields(self, node: ast.AST) -> ast.AST:
+        # same as NodeTransformer.generic_visit, with lists handled by transform_nodes
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                setattr(node, field, self.transform_nodes(value))
+            elif isinstance(value, ast.AST):
+                new_node = self.visit(value)
+                if new_node is None:
+                    delattr(node, field)
+                else:
+                    setattr(node, field, new_node)
+        return node
+
+    def transform_nodes(self, nodes: list) -> list:
+        # plain statements go straight into the new list, without a [set_line, statement] list each
+        new_nodes = []
+        for node in nodes:
+            if not isinstance(node, ast.AST):
+                new_nodes.append(node)
+                continue
+            if (
+                isinstance(node, ast.stmt)
+                and not hasattr(self, "visit_" + node.__class__.__name__)
+                and not is_glob_import(node)
+            ):
+                new_nodes.append(self.set_line(node.lineno))
+                new_nodes.append(self.transform_fields(node))
+                continue
+            new_node = self.visit(node)
+            if isinstance(new_node, list):
+                new_nodes.extend(new_node)
+            elif new_node is not None:
+                new_nodes.append(new_node)
+        return new_nodes
+
+
+class ReplaceChains(ast.NodeTransformer):
+    def __init__(self, replacements: dict[tuple[str, ...], str]):
+        super().__init__()
+        self.replacements = replacements
+
+    def generic_visit(self, node):
+        return walk_children(node, self.replace)
+
+    def replace(self, node: ast.AST) -> tuple[ast.AST, bool]:
+        if isinstance(
+            node,
+            (
+                ast.FunctionDef,
+                ast.AsyncFunctionDef,
+                ast.ClassDef,
+                ast.Lambda,
+                ast.GeneratorExp,
+                ast.Try,
+                ast.TryStar,
+            ),
+        ):
+            # nested scopes may run after the loop, keep their lookups late
+            # lookups in try blocks may be handled, keep them in the block
+            return node, False
+        if isinstance(node, ast.Attribute) and isinstance(node.ctx, ast.Load):
+            local = self.replacements.get(attribute_chain(node))
+            if local:
+                return ast.copy_location(ast.Name(local, ast.Load()), node), False
+        return node, True
+
+
+class HoistGlobals(ast.NodeTransformer):
+    """
+    Bind module globals read inside loops to locals right before the loop.
+
+    Runs on the output of TransformGlobals. Only globals bound by a top-level
+    statement before the function are hoisted, as the loop may not run at all.
+    Globals that are written in the function or declared `global` anywhere in
+    the module are never hoisted, neither are lookups in try blocks.
+    Attribute chains (a.b.c) are only hoisted as a whole if they are called
+    and lead through bundled modules to a global of the last one that is
+    bound once at its top level, anything else may change while the loop runs.
+    """
+
+    def __init__(self, compyner: "ComPYner", tmp_self: str, mutable_globals):
+        super().__init__()
+        self.compyner = compyner
+        self.tmp_self = tmp_self
+        self.mutable_globals = set(mutable_globals)
+        self.bound = set()
+        self.stable = {}
+
+    def visit_Module(self, node: ast.Module):
+        # globals bound once, bundled modules imported at the top level are bound to their name
+        assigned = Counter()
+        imported = {}
+        modules = set(self.compyner.names_for_modules.values())
+        for stmt in node.body:
+            walk_children(ast.Module([stmt], []), functools.partial(self.count_assigned, assigned))
+            match stmt:
+                case Emit(template="{}.{} = {}", args=(root, name, module)) if (
+                    root == self.tmp_self and module in modules
+                ):
+                    imported[name] = module
+        self.stable = {
+            name: module
+            for name, module in imported.items()
+            if assigned[name] == 1 and name not in self.mutable_globals
+        }
+        # a function runs after the top-level statements before it, their globals are bound
+        for stmt in node.body:
+            self.visit(stmt)
+            self.update_bound(stmt)
+        self.stable = {
+            name: self.stable.get(name)
+            for name in self.bound
+            if assigned[name] == 1 and name not in self.mutable_globals
+        }
+        self.compyner.stable_globals[self.tmp_self] = self.stable
+        return node
+
+    def count_assigned(self, assigned: Counter, node: ast.AST) -> tuple[ast.AST, bool]:
+        # every top-level binding of a global, also in blocks; functions need `global` for that
+        match node:
+            case ast.FunctionDef() | ast.AsyncFunctionDef() | ast.ClassDef() | ast.Lambda():
+                return node, False
+            case ast.Attribute(ast.Name(id=root), name, ast.Store() | ast.Del()) if (
+                root == self.tmp_self
+            ):
+                assigned[name] += 1
+            case Emit(template=template, args=(root, name, *_)) if (
+                root == self.tmp_self and template.startswith("{}.{} = ")
+            ):
+                assigned[name] += 1
+        return node, True
+
+    def update_bound(self, stmt: ast.AST):
+        # only unconditional statements count, blocks may bind nothing
+        match stmt:
+            case ast.Assign(targets=targets):
+                self.bound.update(self.global_targets(targets))
+            case ast.AnnAssign(target=target, value=ast.expr()):
+                self.bound.update(self.global_targets([target]))
+            case Emit(template=template, args=(root, name, *_)) if (
+                root == self.tmp_self and template.startswith("{}.{} = ")
+            ):
+                self.bound.add(name)
+            case ast.Delete(targets=targets):
+                self.bound.difference_update(self.global_targets(targets))
+
+    def global_targets(self, targets: list[ast.expr]) -> set[str]:
+        # module.name targets, also inside tuples and lists
+        names = set()
+        for target in targets:
+            for subnode in ast.walk(target):
+                match subnode:
+                    case ast.Attribute(ast.Name(id=root), name, ast.Store() | ast.Del()) if (
+                        root == self.tmp_self
+                    ):
+                        names.add(name)
+        return names
+
+    def generic_visit(self, node):
+        # functions are never nested in expressions
+        if isinstance(node, ast.expr):
+            return node
         return super().generic_visit(node)
 
+    def visit_FunctionDef(self, node: ast.FunctionDef):
+        # hoist nested functions first, they are skipped when collecting
+        self.generic_visit(node)
+
+        if node in self.compyner.late_binding:
+            return node
+
+        written = {
+            attribute_chain(n)
+            for n in ast.walk(node)
+            if isinstance(n, ast.Attribute) and not isinstance(n.ctx, ast.Load)
+        }
+        node.body = self.hoist_block(node.body, written, {})
+        return node
+
+    def hoist_block(self, body, written, locals_) -> list[ast.stmt]:
+        new_body = []
+        for stmt in body:
+            if isinstance(stmt, (ast.For, ast.While)):
+                new_body.extend(self.hoist_loop(stmt, written, locals_))
+            elif not isinstance(
+                stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+            ):
+                # descend into if/with/try/match blocks
+                for child in [
+                    stmt,
+                    *getattr(stmt, "handlers", []),
+                    *getattr(stmt, "cases", []),
+                ]:
+                    for field in ("body", "orelse", "finalbody"):
+                        block = getattr(child, field, None)
+                        if isinstance(block, list):
+                            setattr(
+                                child,
+                                field,
+                                self.hoist_block(block, written, locals_),
+                            )
+            new_body.append(stmt)
+        return new_body
+
+    def is_hoistable(self, chain, written) -> bool:
+        if len(chain) < 2 or chain[1] in self.mutable_globals or chain[1] not in self.bound:
+            return False
+        if len(chain) > 2 and not self.is_stable_chain(chain):
+            return False
+        # rebinding any part of the chain invalidates it
+        return not any(chain[: len(w)] == w for w in written if w)
+
+    def is_stable_chain(self, chain) -> bool:
+        # module.other_module.function, every link but the last one has to be a bundled module
+        module = self.stable.get(chain[1])
+        for attr in chain[2:]:
+            if module is None:
+                return False
+            # modules are transformed (and hoisted) before the modules importing them
+            stable = self.compyner.stable_globals.get(module, {})
+            if attr not in stable:
+                return False
+            module = stable[attr]
+        return True
+
+    def collect(self, loop: ast.stmt) -> dict:
+        # chain => (first node, whether it is called)
+        found = {}
+        called = set()
+
+        def visit(node: ast.AST) -> tuple[ast.AST, bool]:
+            if node is getattr(loop, "iter", None) or node in called or isinstance(
+                node,
+                (
+                    ast.FunctionDef,
+                    ast.AsyncFunctionDef,
+                    ast.ClassDef,
+                    ast.Lambda,
+                    ast.GeneratorExp,
+                    ast.Try,
+                    ast.TryStar,
+                ),
+            ):
+                # the iterable of a for loop is only evaluated once
+                return node, False
+            if isinstance(node, ast.Call):
+                chain = attribute_chain(node.func)
+                if chain and chain[0] == self.tmp_self and len(chain) > 2:
+                    found.setdefault(chain, (node.func, True))
+                    called.add(node.func)
+            elif isinstance(node, ast.Attribute) and isinstance(node.ctx, ast.Load):
+                chain = attribute_chain(node)
+                if chain and chain[0] == self.tmp_self:
+                    found.setdefault(chain[:2], (node, False))
+                    return node, False
+            return node, True
+
+        walk_children(loop, visit)
+        return found
+
+    def hoist_loop(self, loop: ast.stmt, written, locals_) -> list[ast.stmt]:
+        found = self.collect(loop)
+        replacements = {}
+        for chain, (original_node, called) in found.items():
+            for candidate in (chain, chain[:2]) if called else (chain,):
+                if self.is_hoistable(candidate, written):
+                    replacements[candidate] = original_node
+                    break
+
+        if not replacements:
+            return []
+
+        assigns = []
+        for chain, original_node in replacements.items():
+            if chain not in locals_:
+                locals_[chain] = self.compyner.namer.get_unique_name(
+                    "hoisted_" + "_".join(chain[1:]), local=True
+                )
+            assigns.append(
+                ast.copy_location(
+                    ast.Assign(
+                        targets=[ast.Name(locals_[chain], ast.Store())],
+                        value=chain_to_ast(chain, original_node),
+                    ),
+                    loop,
+                )
+            )
+
+        ReplaceChains(
+            {chain: locals_[chain] for chain in replacements}
+        ).generic_visit(loop)
+        return assigns
+
 
 class Namer:
     def __init__(self, prefix=None, keep_name=True, random_length=0):
@@ -569,6 +1175,8 @@ class Namer:
         self.prefix = prefix or ""
         self.keep_name = keep_name
         self.random_length = random_length
+        self.names = []
+        self.local_names = set()
 
     def generate_random_string(self):
         return "".join(
@@ -577,7 +1185,7 @@ class Namer:
             )
         )
 
-    def get_unique_name(self, name: str = ""):
+    def get_unique_name(self, name: str = "", local: bool = False):
         parts = [self.prefix]
         if self.keep_name and name:
             parts.append(re.sub(r"\W", "_", name))
@@ -587,9 +1195,306 @@ class Namer:
         self.taken_names[new_name] += 1
         if self.taken_names[new_name] > 1:
             new_name += "_" + str(self.taken_names[new_name])
+        self.names.append(new_name)
+        if local:
+            # only used inside a single function
+            self.local_names.add(new_name)
         return new_name
 
 
+QSTR_OVERHEAD = 8  # hash, length, terminator and pool pointer of a MicroPython qstr
+RESERVED_NAMES = (
+    set(dir(builtins)) | set(keyword.kwlist) | {"const", "micropython"}
+)
+
+
+def identifiers(node: ast.AST) -> tuple[Counter, Counter]:
+    # count every identifier in the tree, attribute names are counted separately as they can't collide
+    names = Counter()
+    attributes = Counter()
+    for subnode in ast.walk(node):
+        match subnode:
+            case ast.Attribute():
+                attributes[subnode.attr] += 1
+            case ast.Name():
+                names[subnode.id] += 1
+            case ast.FunctionDef() | ast.AsyncFunctionDef() | ast.ClassDef():
+                names[subnode.name] += 1
+            case ast.arg() | ast.keyword() if subnode.arg:
+                names[subnode.arg] += 1
+            case ast.alias():
+                names.update((subnode.asname or subnode.name).split("."))
+            case ast.Global() | ast.Nonlocal():
+                names.update(subnode.names)
+            case ast.ExceptHandler() | ast.MatchAs() | ast.MatchStar() if subnode.name:
+                names[subnode.name] += 1
+            case Emit():
+                names.update(
+                    arg for arg in subnode.args if isinstance(arg, str) and arg.isidentifier()
+                )
+    return names, attributes
+
+
+def qstr_bytes(names) -> int:
+    return sum(len(name) + QSTR_OVERHEAD for name in names)
+
+
+def short_names():
+    # a, b, ..., _, aa, ab, ...
+    first = string.ascii_letters + "_"
+    rest = first + string.digits
+    for length in itertools.count(1):
+        for head in first:
+            for tail in itertools.product(rest, repeat=length - 1):
+                name = head + "".join(tail)
+                if not name.startswith("__"):
+                    yield name
+
+
+class ShortNames:
+    """
+    Rename generated identifiers to the shortest free names, most referenced first.
+
+    Every distinct identifier is a qstr in MicroPython RAM, so generated names
+    are as short as possible and function local names (hoisted globals) reuse
+    the same names in every function.
+    """
+
+    def __init__(self, namer: Namer):
+        self.namer = namer
+
+    def rename(self, module: ast.Module) -> dict[str, str]:
+        names, attributes = identifiers(module)
+        generated = set(self.namer.names)
+        # attribute-only names can be reused, they are qstrs already
+        reserved = (set(names) - generated) | RESERVED_NAMES
+
+        global_names = sorted(
+            generated - self.namer.local_names, key=lambda name: (-names[name], name)
+        )
+        mapping = dict(zip(global_names, self.free_names(reserved)))
+
+        for function in ast.walk(module):
+            if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            used, _ = identifiers(function)
+            own = sorted(
+                (name for name in used if name in self.namer.local_names and name not in mapping),
+                key=lambda name: (-used[name], name),
+            )
+            # don't shadow generated globals used in the function
+            taken = reserved | {mapping[name] for name in used if name in mapping}
+            mapping.update(zip(own, self.free_names(taken)))
+
+        before = qstr_bytes(set(names) | set(attributes))
+        RenameNames(mapping).visit(module)
+        names, attributes = identifiers(module)
+        logger.info(
+            "Estimated qstr bytes: %d -> %d", before, qstr_bytes(set(names) | set(attributes))
+        )
+        return mapping
+
+    @staticmethod
+    def free_names(taken):
+        return (name for name in short_names() if name not in taken)
+
+
+class RenameNames(ast.NodeVisitor):
+    def __init__(self, mapping: dict[str, str]):
+        super().__init__()
+        self.mapping = mapping
+
+    def visit(self, node):
+        # every node is renamed on its own, walk the tree without recursion
+        for node in ast.walk(node):
+            match node:
+                case ast.Name():
+                    node.id = self.mapping.get(node.id, node.id)
+                case ast.FunctionDef() | ast.AsyncFunctionDef() | ast.ClassDef():
+                    node.name = self.mapping.get(node.name, node.name)
+                case ast.alias() if node.asname:
+                    node.asname = self.mapping.get(node.asname, node.asname)
+                case Emit():
+                    node.args = tuple(
+                        self.mapping.get(arg, arg) if isinstance(arg, str) else arg
+                        for arg in node.args
+                    )
+
+
+# MicroPython interns shorter string literals as qstrs, so their duplicates are free
+POOL_MIN_SIZE = 10
+
+
+def constant_size(value: str | bytes) -> int:
+    return len(value.encode() if isinstance(value, str) else value)
+
+
+class PoolConstants:
+    """
+    Replace repeated str and bytes constants by a shared global defined at the top of the program.
+
+    Every function keeps its own copy of a long constant in MicroPython. Loops
+    and comprehensions are left alone, as a global lookup is slower than
+    loading a constant. Docstrings, f-strings, match patterns and const()
+    arguments have to stay constants.
+    """
+
+    def __init__(self, namer: Namer, min_size: int = POOL_MIN_SIZE):
+        self.namer = namer
+        self.min_size = min_size
+        self.counts = Counter()
+        self.names = None
+
+    def pool(self, program: ast.Module) -> ast.Module:
+        walk_children(program, self.replace)
+        self.names = {}
+        total = 0
+        for (kind, value), count in self.counts.items():
+            if count < 2:
+                continue
+            name = self.namer.get_unique_name("const")
+            saved = (count - 1) * constant_size(value) - len(name) - QSTR_OVERHEAD
+            if saved <= 0:
+                continue
+            self.names[kind, value] = name
+            total += saved
+            logger.info("Pooled %.40r (%d uses): %d bytes saved", value, count, saved)
+        if total:
+            logger.info("Pooled %d constants: %d bytes saved", len(self.names), total)
+        walk_children(program, self.replace)
+        program.body[0:0] = [
+            ast.Assign([ast.Name(name, ast.Store())], ast.Constant(value), lineno=0)
+            for (_, value), name in self.names.items()
+        ]
+        return program
+
+    def replace(self, node: ast.AST) -> tuple[ast.AST, bool]:
+        match node:
+            case ast.Constant(value=str() | bytes() as value) if constant_size(value) >= self.min_size:
+                key = (type(value), value)
+                # first walk counts, second one replaces
+                if self.names is None:
+                    self.counts[key] += 1
+                elif key in self.names:
+                    return ast.copy_location(ast.Name(self.names[key], ast.Load()), node), False
+                return node, False
+            case (
+                ast.Expr(value=ast.Constant())
+                | ast.Call(func=ast.Name(id="const"))
+                | ast.For()
+                | ast.AsyncFor()
+                | ast.While()
+                | ast.ListComp()
+                | ast.SetComp()
+                | ast.DictComp()
+                | ast.GeneratorExp()
+                | ast.JoinedStr()
+                | ast.pattern()
+            ):
+                return node, False
+        return node, True
+
+
+class PreprocessPass(Pass):
+    name = "preprocess"
+
+    def __init__(self, preprocessor):
+        self.preprocessor = preprocessor
+
+    def cache_key(self) -> str:
+        return f"{self.name}:{callable_key(self.preprocessor)}"
+
+    def run(self, compyner: "ComPYner", module: ModuleUnit) -> ModuleUnit:
+        module.tree = self.preprocessor(module.tree, module.origin or module.name)
+        return module
+
+
+class DiscoverGlobalsPass(Pass):
+    name = "discover-globals"
+    after = ("preprocess",)
+
+    def run(self, compyner: "ComPYner", module: ModuleUnit) -> ModuleUnit:
+        gf = DiscoverGlobals()
+        gf.visit(module.tree)
+        module.globals = gf.globals
+        module.has_dunder_name = gf.has_dunder_name
+        return module
+
+
+class TransformGlobalsPass(Pass):
+    name = "transform-globals"
+    requires = ("discover-globals",)
+
+    def run(self, compyner: "ComPYner", module: ModuleUnit) -> ModuleUnit:
+        module.varname = compyner.namer.get_unique_name("module_" + module.name)
+
+        old_file = compyner.current_file
+        compyner.current_file = module.path
+        module.tree = TransformGlobals(
+            compyner,
+            module.globals,
+            parent=module.parent,
+            tmp_self=module.varname,
+            module=module.name,
+        ).visit(module.tree)
+        compyner.current_file = old_file
+        return module
+
+
+class HoistGlobalsPass(Pass):
+    name = "hoist-globals"
+    requires = ("transform-globals",)
+
+    def run(self, compyner: "ComPYner", module: ModuleUnit) -> ModuleUnit:
+        module.tree = HoistGlobals(
+            compyner,
+            module.varname,
+            [name for name, context in module.globals if context],
+        ).visit(module.tree)
+        return module
+
+
+class PoolConstantsPass(Pass):
+    name = "pool-constants"
+    level = "program"
+    before = ("short-names",)
+
+    def __init__(self, min_size: int = POOL_MIN_SIZE):
+        self.min_size = min_size
+
+    def cache_key(self) -> str:
+        return f"{self.name}:{self.version}:{self.min_size}"
+
+    def run(self, compyner: "ComPYner", program: ast.Module) -> ast.Module:
+        return PoolConstants(compyner.namer, self.min_size).pool(program)
+
+
+class ShortNamesPass(Pass):
+    name = "short-names"
+    level = "program"
+
+    def run(self, compyner: "ComPYner", program: ast.Module) -> ast.Module:
+        mapping = ShortNames(compyner.namer).rename(
+            ast.Module([module_class_def(compyner.module_class_name), *program.body], [])
+        )
+        compyner.module_class_name = mapping[compyner.module_class_name]
+        return program
+
+
+class PastprocessPass(Pass):
+    name = "pastprocess"
+    level = "output"
+
+    def __init__(self, pastprocessor):
+        self.pastprocessor = pastprocessor
+
+    def cache_key(self) -> str:
+        return f"{self.name}:{callable_key(self.pastprocessor)}"
+
+    def run(self, compyner: "ComPYner", code: str) -> str:
+        return self.pastprocessor(code)
+
+
 class ComPYner:
     def __init__(
         self,
@@ -599,8 +1504,22 @@ class ComPYner:
         require_dunder_name=False,
         keep_names=True,
         random_name_length=0,
+        hoist_globals=False,
+        target=None,
+        short_names=False,
+        passes=None,
+        emitters=None,
+        staged=None,
+        pool_constants=None,
     ):
+        if staged not in (None, *STAGE_FORMATS):
+            raise ValueError(f"Unknown stage format {staged}, use one of {', '.join(STAGE_FORMATS)}")
         self.exclude_modules = exclude_modules or []
+        self.emitters = emitters or []
+        self.staged = staged
+        self.target_modules = load_target(target) if target else frozenset()
+        self.host_stdlib_modules = []
+        self.target_excluded_modules = []
         self.loaded_modules = []
         self.current_modules = []
         self.module_preprocessor = module_preprocessor or (lambda x, y: x)
@@ -609,7 +1528,34 @@ class ComPYner:
             keep_name=keep_names, random_length=random_name_length, prefix="c"
         )
         self.require_dunder_name = require_dunder_name
+        self.hoist_globals = hoist_globals
+        self.short_names = short_names
+        self.pipeline = Pipeline(
+            [
+                PreprocessPass(self.module_preprocessor),
+                DiscoverGlobalsPass(),
+                TransformGlobalsPass(),
+                *([HoistGlobalsPass()] if hoist_globals else []),
+                *([PoolConstantsPass(pool_constants)] if pool_constants else []),
+                *([ShortNamesPass()] if short_names else []),
+                PastprocessPass(self.pastprocessor),
+                *(passes or []),
+            ]
+        )
         self.module_class_name = self.namer.get_unique_name("Module")
+        self.lazy_modules_class_name = None
+        # functions decorated with @late_binding, never hoisted
+        self.late_binding = set()
+        # module varname => globals bound once at its top level => module varname or None
+        self.stable_globals = {}
+        self.lazy_modules = {}
+        # loader definitions of lazily bundled modules, and how many registries are being bundled
+        self.lazy_loaders = []
+        self.lazy_registries = 0
+        if staged:
+            self.stage_loader = self.namer.get_unique_name("stage")
+            self.stage_table = self.namer.get_unique_name("stages")
+            self.stage_count = 0
         self.names_for_modules = {}
         self.current_file = "<comPYned>"
 
@@ -619,21 +1565,72 @@ class ComPYner:
     def set_line(self, line: int) -> ast.Comment:
         return ast.Comment(f"##{self.current_file}:{line}##", inline=False)
 
-    def import_module(self, name: str, parent: str = None) -> bool:
-        # If top parent is excluded, do not import module
-        if name.split(".", 1)[0] in self.exclude_modules:
-            return False, []
+    def check_host_stdlib(self, spec):
+        # warn (once) about modules bundled from the host's standard library
+        if spec.name in self.host_stdlib_modules or not is_host_stdlib(spec.origin):
+            return
+        self.host_stdlib_modules.append(spec.name)
+        logger.warning(
+            "Module %s is bundled from the standard library of the host (%s). It will most likely not work in the target environment, exclude it or use --target.",
+            spec.name,
+            spec.origin,
+        )
+
+    def emitter_for(self, module: str, context: list[str], node: ast.FunctionDef) -> str | None:
+        # the first matching rule decides, functions already using an emitter are left alone
+        if not self.emitters or any(map(is_emitter_decorator, node.decorator_list)):
+            return None
+        qualname = ".".join(context)
+        # profiles report the line of the first decorator
+        lineno = min([node.lineno, *(n.lineno for n in node.decorator_list)])
+        for rule in self.emitters:
+            if rule.matches(module, qualname, self.current_file, lineno):
+                return choose_emitter(
+                    node, rule.emitter, f"{module}:{qualname} ({self.current_file}:{node.lineno})"
+                )
+        return None
+
+    def is_excluded(self, name: str) -> bool:
+        # If top parent is excluded or provided by the target, do not import module
+        top = name.split(".", 1)[0]
+        if top in self.exclude_modules:
+            return True
+        if top in self.target_modules:
+            self.log_target_exclusion(top)
+            return True
+        return False
+
+    def log_target_exclusion(self, name: str):
+        # log (once) every module the target provides, warn if the project has its own
+        if name in self.target_excluded_modules:
+            return
+        self.target_excluded_modules.append(name)
+        path = project_path()
+        if (path / f"{name}.py").is_file() or (path / name / "__init__.py").is_file():
+            logger.warning(
+                "Module %s of the project is not bundled: The target provides a module with the same name. Rename it to bundle it.",
+                name,
+            )
+        else:
+            logger.info("Module %s is provided by the target, not bundling it.", name)
 
+    def find_spec(self, name: str, parent: str = None):
         # look for polyfill
         try:
             special_spec = importlib.util.find_spec("compyned_polyfills." + name)
             if special_spec:
-                return self.import_module_from_spec(special_spec, name)
+                return special_spec
         except ModuleNotFoundError:
             pass
 
+        return importlib.util.find_spec(name, parent)
+
+    def import_module(self, name: str, parent: str = None) -> bool:
+        if self.is_excluded(name):
+            return False, []
+
         # get spec and go from there
-        spec = importlib.util.find_spec(name, parent)
+        spec = self.find_spec(name, parent)
         return self.import_module_from_spec(spec, name)
 
     def import_module_from_spec(self, spec, name=None) -> tuple[str, list[ast.stmt]]:
@@ -641,17 +1638,13 @@ class ComPYner:
         if not spec:
             raise ModuleNotFoundError(f"Module {name} not found")
 
-        # Warn about builtin modules
-        if spec.origin == "built-in":
-            logger.warning(
-                "Module %s cannot be included: It is a built-in module. Excluded automatically, make sure it exists in the target environment.",
-                name,
-            )
-            return False, []
-        if not spec.has_location:
+        # Warn about builtin and compiled modules
+        reason = not_bundlable(spec)
+        if reason:
             logger.warning(
-                "Module %s cannot be included: It does not have a location. Excluded automatically, make sure it exists in the target environment.",
+                "Module %s cannot be included: %s. Excluded automatically, make sure it exists in the target environment.",
                 name,
+                reason,
             )
             return False, []
 
@@ -661,8 +1654,13 @@ class ComPYner:
                 f"Recursive import detected: {' > '.join(self.current_modules)} >> {spec.name}"
             )
 
+        # initialized by a lazy registry on first lookup, make sure it is before it is used
+        if spec.name in self.lazy_modules:
+            return spec.name, [Emit("{}()", (self.lazy_modules[spec.name],))]
+
         # if not imported before
         if spec.name not in self.loaded_modules:
+            self.check_host_stdlib(spec)
             # build module and return for insertion
             self.current_modules.append(spec.name)
             body = self.transform_module(
@@ -673,10 +1671,62 @@ class ComPYner:
             )
             self.current_modules.pop()
             self.loaded_modules.append(spec.name)
+            if self.staged:
+                body = [self.stage(spec.name, body)]
+            if self.lazy_registries:
+                return spec.name, self.lazy_loader(spec.name, body)
             return spec.name, body
 
         return spec.name, []
 
+    def lazy_modules_class(self) -> str:
+        # the registry class is only added to bundles using __lazy_glob_import__
+        if self.lazy_modules_class_name is None:
+            self.lazy_modules_class_name = self.namer.get_unique_name("LazyModules")
+        return self.lazy_modules_class_name
+
+    def lazy_loader(self, name: str, body: list[ast.stmt]) -> list[ast.stmt]:
+        # modules bundled for a lazy registry are initialized by their own loader when first
+        # used, so a plugin never initializes another plugin sharing a module with it.
+        # Loaders are defined at the top of the program, imports anywhere can call them
+        loader = self.namer.get_unique_name("load_" + name)
+        varname = self.names_for_modules[name]
+        self.lazy_modules[name] = loader
+        self.lazy_loaders.append(
+            ast.FunctionDef(
+                name=loader,
+                args=ast.arguments([], [], None, [], [], None, []),
+                body=[
+                    Emit("global {}", (varname,)),
+                    # initialized already, by another import of the module
+                    ast.Try(
+                        body=[ast.Return(ast.Name(varname, ast.Load()))],
+                        handlers=[
+                            ast.ExceptHandler(ast.Name("NameError", ast.Load()), None, [ast.Pass()])
+                        ],
+                        orelse=[],
+                        finalbody=[],
+                    ),
+                    *body,
+                    ast.Return(ast.Name(varname, ast.Load())),
+                ],
+                decorator_list=[],
+                returns=None,
+                type_params=[],
+                lineno=0,
+                col_offset=0,
+                end_lineno=0,
+                end_col_offset=0,
+            )
+        )
+        return [Emit("{}()", (loader,))]
+
+    def stage(self, name: str, body: list[ast.stmt]) -> Stage:
+        # stages are numbered in the order their modules finished transforming
+        index = self.stage_count
+        self.stage_count += 1
+        return Stage(name, index, Emit("{}({})", (self.stage_loader, index)), body)
+
     def transform_module(
         self, name: str, module: ast.Module, parent: str = None, origin: str = None
     ):
@@ -688,48 +1738,26 @@ class ComPYner:
         )
         logger.info("Adding %-15s from %s", name, simple_path)
 
-        module = self.module_preprocessor(module, origin or name)
-
-        # Discorver globals
-        gf = DiscoverGlobals()
-        gf.visit(module)
-
-        module_varname = self.namer.get_unique_name("module_" + name)
-
-        # Transform globals
-        old_file = self.current_file
-        self.current_file = simple_path
-        tree = TransformGlobals(
-            self, gf.globals, parent=parent, tmp_self=module_varname
-        ).visit(module)
-        self.current_file = old_file
+        # Run module passes (globals discovery, transformation, ...)
+        unit = self.pipeline.run(
+            "module", self, ModuleUnit(name, module, parent, origin, simple_path)
+        )
 
         # Store module as already imported for later access
-        self.names_for_modules[name] = module_varname
+        self.names_for_modules[name] = unit.varname
 
         # Produce transformed module
         return [
             # Set file path for debug
             self.set_file(simple_path),
             # Create Module object
-            ast.Assign(
-                targets=[ast.Name(module_varname, ast.Load())],
-                value=ast.Call(
-                    func=(ast.Name(self.module_class_name, ast.Load())),
-                    args=(
-                        [ast.Constant(value=name)]
-                        if gf.has_dunder_name or self.require_dunder_name
-                        else []
-                    ),
-                    keywords=[],
-                ),
-                lineno=0,
-                col_offset=0,
-                end_lineno=0,
-                end_col_offset=0,
+            (
+                Emit("{} = {}({!r})", (unit.varname, self.module_class_name, name))
+                if unit.has_dunder_name or self.require_dunder_name
+                else Emit("{} = {}()", (unit.varname, self.module_class_name))
             ),
             # Module body
-            *tree.body,
+            *unit.tree.body,
         ]
 
     def compyne_from_ast(
@@ -739,27 +1767,58 @@ class ComPYner:
         parent: str = None,
         origin: str = None,
     ):
-        return self.pastprocessor(
-            NoneFriendlyUnparser().visit(
-                ast.Module(
-                    [
-                        ast.ClassDef(
-                            name=self.module_class_name,
-                            bases=[ast.Name("dict", ast.Load())],
-                            keywords=[],
-                            body=[*(MODULE_CLASS_BODY).body],
-                            decorator_list=[],
-                            lineno=0,
-                            col_offset=0,
-                            end_lineno=0,
-                            end_col_offset=0,
-                        ),
-                        *self.transform_module(name, module, parent, origin),
-                    ],
-                    [],
+        # nested imports and the unparser recurse, deep programs need a higher limit
+        with recursion_limit(), fewer_collections():
+            body = self.transform_module(name, module, parent, origin)
+            if self.lazy_modules_class_name:
+                body = [
+                    lazy_modules_class_def(self.lazy_modules_class_name),
+                    *self.lazy_loaders,
+                    *body,
+                ]
+            if self.staged:
+                table, loader = stage_loader(self)
+                body = [*loader, *body]
+            program = self.pipeline.run("program", self, ast.Module(body, []))
+            with self.pipeline.time("unparse"):
+                if self.staged:
+                    table.args = (table.args[0], render_stages(program, self.staged))
+                code = (
+                    module_class_source(self.module_class_name)
+                    + "\n"
+                    + NoneFriendlyUnparser().visit(program)
                 )
+            return self.pipeline.run("output", self, code)
+
+    def cache_key(self, origin: str, *sources: str) -> str:
+        # changes whenever comPYner, an option, a pass, a source or its location changes
+        options = repr(
+            (
+                compyner_version(),
+                origin,
+                str(Path.cwd()),
+                sorted(self.exclude_modules),
+                sorted(self.target_modules),
+                self.require_dunder_name,
+                self.namer.keep_name,
+                self.namer.random_length,
+                self.emitters,
+                self.staged,
             )
         )
+        return self.pipeline.cache_key(options, *sources)
+
+
+@functools.cache
+def compyner_version() -> str:
+    # built-in passes keep their version, a source checkout has no metadata, use its code
+    try:
+        return importlib.metadata.version("compyner")
+    except importlib.metadata.PackageNotFoundError:
+        digest = hashlib.sha256()
+        for file in sorted(Path(__file__).parent.rglob("*.py")):
+            digest.update(file.read_bytes())
+        return digest.hexdigest()
 
 
 class LocationSearcher(ast.NodeVisitor):
@@ -0,0 +1,218 @@
+import ast
+import json
+from collections import defaultdict
+from pathlib import Path
+
+from .engine import ComPYner, glob_import_specs, is_compile_time, not_bundlable, walk_children
+
+
+class DiscoverImports(ast.NodeVisitor):
+    """
+    Collect the imports of a module without transforming it.
+
+    Imports are stored as (name, is_glob) pairs, relative imports keep their leading dots.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.imports = []
+
+    def visit(self, node: ast.AST):
+        walk_children(node, self.discover)
+
+    def discover(self, node: ast.AST) -> tuple[ast.AST, bool]:
+        match node:
+            case ast.If(test=ast.Attribute(ast.Name("typing"), "TYPE_CHECKING")):
+                return node, False
+            case ast.FunctionDef() if is_compile_time(node):
+                return node, False
+            case ast.Import():
+                for alias in node.names:
+                    self.imports.append((alias.name, False))
+                return node, False
+            case ast.ImportFrom(module="compyner.typehints"):
+                return node, False
+            case ast.ImportFrom(module=None):
+                # from . import a is imported as .a
+                for alias in node.names:
+                    self.imports.append(("." * node.level + alias.name, False))
+                return node, False
+            case ast.ImportFrom():
+                self.imports.append(("." * node.level + node.module, False))
+                return node, False
+            case ast.Call(
+                func=ast.Name(id="__glob_import__" | "__lazy_glob_import__"),
+                args=[ast.Constant()],
+            ):
+                self.imports.append((node.args[0].value, True))
+        return node, True
+
+
+class ImportGraph:
+    def __init__(self):
+        self.origins = {}
+        self.imports = defaultdict(list)
+        self.excluded = set()
+
+    def add_module(self, name: str, origin: str | None):
+        self.origins[name] = origin
+        self.imports[name]
+
+    def add_import(self, importer: str, name: str):
+        if name not in self.imports[importer]:
+            self.imports[importer].append(name)
+
+    def cycles(self) -> list[list[str]]:
+        """
+        Return one import cycle per strongly connected component, e.g. [a, b, a].
+        """
+        # iterative tarjan, so deep graphs can't blow the stack
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+        for root in self.imports:
+            if root in index:
+                continue
+            work = [(root, iter(self.imports[root]))]
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self.imports[child])))
+                        break
+                    if child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.remove(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        if len(component) > 1 or node in self.imports[node]:
+                            components.append(component)
+
+        return [self._cycle_in(set(component)) for component in components]
+
+    def _cycle_in(self, component: set[str]) -> list[str]:
+        # walk inside the component until a module repeats
+        start = min(component)
+        path = [start]
+        seen = {start: 0}
+        while True:
+            node = next(n for n in self.imports[path[-1]] if n in component)
+            if node in seen:
+                return path[seen[node] :] + [node]
+            seen[node] = len(path)
+            path.append(node)
+
+    def batches(self) -> list[list[str]]:
+        """
+        Return modules grouped so that every module only imports modules of earlier batches.
+        """
+        cycles = self.cycles()
+        if cycles:
+            raise RecursionError(
+                "Recursive imports detected: "
+                + "; ".join(" > ".join(cycle) for cycle in cycles)
+            )
+        remaining = {name: set(imports) for name, imports in self.imports.items()}
+        batches = []
+        while remaining:
+            batch = sorted(name for name, imports in remaining.items() if not imports)
+            batches.append(batch)
+            for name in batch:
+                del remaining[name]
+            for imports in remaining.values():
+                imports.difference_update(batch)
+        return batches
+
+    def to_dict(self) -> dict:
+        return {
+            "modules": {
+                name: {"origin": self.origins.get(name), "imports": imports}
+                for name, imports in self.imports.items()
+            },
+            "excluded": sorted(self.excluded),
+            "cycles": self.cycles(),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_dot(self) -> str:
+        lines = ["digraph imports {"]
+        for name in sorted(self.excluded):
+            lines.append(f'    "{name}" [style=dashed];')
+        for name, imports in self.imports.items():
+            lines.append(f'    "{name}";')
+            for imported in imports:
+                lines.append(f'    "{name}" -> "{imported}";')
+        lines.append("}")
+        return "\n".join(lines)
+
+
+def build_import_graph(
+    compyner: ComPYner,
+    name: str,
+    module: ast.Module,
+    parent: str = None,
+    origin: str = None,
+) -> ImportGraph:
+    """
+    Scan the imports of a module and everything it imports, without transforming anything.
+
+    Modules are resolved the same way ComPYner.import_module does, including
+    exclusions, polyfills and __glob_import__.
+    """
+    graph = ImportGraph()
+    graph.add_module(name, origin)
+    work = [(name, module, parent)]
+    while work:
+        importer, module, parent = work.pop()
+        finder = DiscoverImports()
+        finder.visit(module)
+        for import_name, is_glob in finder.imports:
+            if is_glob:
+                specs = glob_import_specs(import_name)
+            elif compyner.is_excluded(import_name):
+                graph.excluded.add(import_name)
+                continue
+            else:
+                spec = compyner.find_spec(import_name, parent)
+                if not spec:
+                    raise ModuleNotFoundError(
+                        f"Module {import_name} not found, imported by {importer}"
+                    )
+                specs = [spec]
+
+            for spec in specs:
+                if not_bundlable(spec):
+                    graph.excluded.add(spec.name)
+                    continue
+                graph.add_import(importer, spec.name)
+                if spec.name in graph.origins:
+                    continue
+                graph.add_module(spec.name, spec.origin)
+                compyner.check_host_stdlib(spec)
+                work.append(
+                    (
+                        spec.name,
+                        ast.parse(Path(spec.origin).read_text(encoding="utf-8")),
+                        spec.parent,
+                    )
+                )
+    return graph
@@ -0,0 +1,186 @@
+import contextlib
+import hashlib
+import marshal
+import time
+from collections import defaultdict
+from importlib.metadata import entry_points
+
+from .logging import logger
+
+LEVELS = ("module", "program", "output")
+ENTRY_POINT_GROUP = "compyner.passes"
+
+
+def callable_key(function) -> str:
+    """
+    Return a key that identifies a function across runs.
+
+    Named functions are identified by their qualified name, lambdas and nested
+    functions (which share their name) by their code, defaults and closure.
+    """
+    qualname = getattr(function, "__qualname__", "")
+    if qualname and "<" not in qualname:
+        return f"{function.__module__}.{qualname}"
+    code = getattr(function, "__code__", None)
+    if code is None:
+        raise ValueError(f"{function!r} has no stable name, results using it can't be cached")
+    digest = hashlib.sha256(marshal.dumps(code))
+    values = [*(function.__defaults__ or ()), *(c.cell_contents for c in function.__closure__ or ())]
+    for value in values:
+        digest.update(repr(value).encode() + b"\0")
+    return digest.hexdigest()
+
+
+class ModuleUnit:
+    """
+    A module while it is being transformed by module passes.
+    """
+
+    def __init__(self, name: str, tree, parent: str = None, origin: str = None, path: str = None):
+        self.name = name
+        self.tree = tree
+        self.parent = parent
+        self.origin = origin
+        self.path = path or name
+        self.globals = []
+        self.has_dunder_name = False
+        self.varname = None
+
+
+class Pass:
+    """
+    A transformation step of the pipeline.
+
+    Module passes get a ModuleUnit for every bundled module, program passes the
+    merged ast.Module and output passes the generated code. `run` returns the
+    (possibly new) unit.
+    """
+
+    name: str = ""
+    level: str = "module"
+    version: int = 1
+    # passes that have to be registered and run before this one
+    requires: tuple[str, ...] = ()
+    # passes this one runs after / before, if they are registered
+    after: tuple[str, ...] = ()
+    before: tuple[str, ...] = ()
+
+    def cache_key(self) -> str:
+        return f"{self.name}:{self.version}"
+
+    def run(self, compyner, unit):
+        raise NotImplementedError
+
+
+class FunctionPass(Pass):
+    def __init__(self, name: str, level: str, function, **ordering):
+        self.name = name
+        self.level = level
+        self.function = function
+        self.requires = ordering.get("requires", ())
+        self.after = ordering.get("after", ())
+        self.before = ordering.get("before", ())
+
+    def cache_key(self) -> str:
+        return f"{self.name}:{callable_key(self.function)}"
+
+    def run(self, compyner, unit):
+        return self.function(compyner, unit)
+
+
+class Pipeline:
+    def __init__(self, passes=()):
+        self.passes = []
+        self.timings = defaultdict(float)
+        self._nested = []
+        self._order = None
+        for pass_ in passes:
+            self.register(pass_)
+
+    def register(self, pass_: Pass):
+        if pass_.level not in LEVELS:
+            raise ValueError(f"Unknown level {pass_.level} of pass {pass_.name}")
+        if any(registered.name == pass_.name for registered in self.passes):
+            raise ValueError(f"Pass {pass_.name} is already registered")
+        self.passes.append(pass_)
+        self._order = None
+
+    def load_entry_point(self, name: str):
+        # third-party passes are registered in the compyner.passes entry point group
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP, name=name):
+            pass_ = entry_point.load()
+            self.register(pass_() if isinstance(pass_, type) else pass_)
+            return
+        raise ValueError(f"No pass {name} installed in entry point group {ENTRY_POINT_GROUP}")
+
+    def order(self) -> list[Pass]:
+        if self._order is not None:
+            return self._order
+
+        by_name = {pass_.name: pass_ for pass_ in self.passes}
+        dependencies = {pass_.name: set() for pass_ in self.passes}
+        for pass_ in self.passes:
+            for required in pass_.requires:
+                if required not in by_name:
+                    raise ValueError(f"Pass {pass_.name} requires missing pass {required}")
+                dependencies[pass_.name].add(required)
+            dependencies[pass_.name].update(name for name in pass_.after if name in by_name)
+            for name in pass_.before:
+                if name in by_name:
+                    dependencies[name].add(pass_.name)
+
+        # stable topological sort, registration order breaks ties
+        order = []
+        while dependencies:
+            ready = [
+                pass_
+                for pass_ in self.passes
+                if pass_.name in dependencies and not dependencies[pass_.name]
+            ]
+            if not ready:
+                raise ValueError(f"Passes depend on each other: {', '.join(dependencies)}")
+            pass_ = ready[0]
+            order.append(pass_)
+            del dependencies[pass_.name]
+            for remaining in dependencies.values():
+                remaining.discard(pass_.name)
+
+        self._order = order
+        return order
+
+    def run(self, level: str, compyner, unit):
+        for pass_ in self.order():
+            if pass_.level != level:
+                continue
+            with self.time(pass_.name):
+                unit = pass_.run(compyner, unit)
+        return unit
+
+    @contextlib.contextmanager
+    def time(self, name: str):
+        # module passes recurse into imported modules, only count the time spent in this pass
+        self._nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] += elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def cache_key(self, *inputs: str) -> str:
+        """
+        Return a key that changes whenever a pass or one of the inputs changes.
+        """
+        digest = hashlib.sha256()
+        for pass_ in self.order():
+            digest.update(pass_.cache_key().encode() + b"\0")
+        for input_ in inputs:
+            digest.update(input_.encode() + b"\0")
+        return digest.hexdigest()
+
+    def log_timings(self):
+        for name, seconds in self.timings.items():
+            logger.info("%-20s %8.3f ms", name, seconds * 1000)
+
@@ -0,0 +1,31 @@
+def __init__(self, loaders, metadata):
+    self._loaders = loaders
+    self._modules = {}
+    self.metadata = metadata
+
+
+def __getitem__(self, name):
+    module = self._modules.get(name)
+    if module is None:
+        module = self._modules[name] = self._loaders[name]()
+    return module
+
+
+def __contains__(self, name):
+    return name in self._loaders
+
+
+def __iter__(self):
+    return iter(self._loaders)
+
+
+def __len__(self):
+    return len(self._loaders)
+
+
+def get(self, name, default=None):
+    return self[name] if name in self._loaders else default
+
+
+def keys(self):
+    return self._loaders.keys()
@@ -4,7 +4,12 @@ def __init__(self, name=None):
 
 
 def __getattr__(self, key):
-    return self[key]
+    # AttributeError, so hasattr() and getattr() with a default work on modules
+    try:
+        return self[key]
+    except KeyError:
+        pass
+    raise AttributeError(key)
 
 
 def __setattr__(self, key, value):
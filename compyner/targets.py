@@ -0,0 +1,108 @@
+from pathlib import Path
+
+# Modules of the MicroPython library (including u-prefixed aliases), ports only provide
+# some of them, e.g. machine, btree, framebuf, socket, ssl and cryptolib depend on the port
+MICROPYTHON_MODULES = frozenset(
+    {
+        "_thread",
+        "array",
+        "asyncio",
+        "binascii",
+        "btree",
+        "builtins",
+        "cmath",
+        "collections",
+        "cryptolib",
+        "deflate",
+        "errno",
+        "framebuf",
+        "gc",
+        "hashlib",
+        "heapq",
+        "io",
+        "json",
+        "machine",
+        "math",
+        "micropython",
+        "os",
+        "platform",
+        "random",
+        "re",
+        "select",
+        "socket",
+        "ssl",
+        "struct",
+        "sys",
+        "time",
+        "uarray",
+        "uasyncio",
+        "ubinascii",
+        "ucollections",
+        "ucryptolib",
+        "uctypes",
+        "uerrno",
+        "uhashlib",
+        "uheapq",
+        "uio",
+        "ujson",
+        "uos",
+        "urandom",
+        "ure",
+        "uselect",
+        "usocket",
+        "ussl",
+        "ustruct",
+        "usys",
+        "utime",
+        "uzlib",
+        "zlib",
+    }
+)
+
+# LEGO SPIKE Prime hub, both the classic (spike/mindstorms) and the SPIKE 3 API
+SPIKE_PRIME_MODULES = MICROPYTHON_MODULES | {
+    "app",
+    "bluetooth",
+    "color",
+    "color_matrix",
+    "color_sensor",
+    "device",
+    "distance_sensor",
+    "force_sensor",
+    "hub",
+    "mindstorms",
+    "motor",
+    "motor_pair",
+    "orientation",
+    "runloop",
+    "runtime",
+    "spike",
+    "ubluetooth",
+    "util",
+    "utimeq",
+}
+
+TARGETS = {
+    "micropython": MICROPYTHON_MODULES,
+    "spike-prime": SPIKE_PRIME_MODULES,
+}
+
+
+def load_target(target: str) -> frozenset[str]:
+    """
+    Return the modules a target provides.
+
+    `target` is either the name of a shipped target or a manifest file with one module per line.
+    """
+    if target in TARGETS:
+        return TARGETS[target]
+    path = Path(target)
+    if not path.is_file():
+        raise ValueError(
+            f"Unknown target {target}, use one of {', '.join(TARGETS)} or a manifest file"
+        )
+    return frozenset(
+        line.strip()
+        for line in path.read_text(encoding="utf-8").splitlines()
+        if line.strip() and not line.lstrip().startswith("#")
+    )
@@ -2,3 +2,19 @@ def __glob_import__(glob: str) -> list[dict]:
     """
     Return all modules whose path matches the given glob.
     """
+
+
+def __lazy_glob_import__(glob: str) -> dict[str, dict]:
+    """
+    Return a registry of all modules whose path matches the given glob, keyed by module name.
+
+    A module is only initialized when it is first looked up, its UPPER_CASE
+    constants are available in `registry.metadata[name]` without initializing it.
+    """
+
+
+def late_binding(func):
+    """
+    Exclude a function from global hoisting, so globals are looked up on every access.
+    """
+    return func
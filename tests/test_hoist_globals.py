@@ -0,0 +1,133 @@
+import contextlib
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import ast_comments as ast
+
+from compyner.engine import ComPYner
+
+HELPERS = """
+value_ = 0
+def value():
+    return value_
+def bump():
+    global value
+    old = value
+    value = lambda: old() + 1
+"""
+
+PROGRAMS = {
+    "guarded by the loop condition": """
+class State:
+    motor = None
+state = State()
+
+def guarded():
+    n = 0
+    while state.motor is not None:
+        state.motor.run()
+        n += 1
+    return n
+
+print(guarded())
+""",
+    "guarded by an if": """
+import helpers
+
+def cond():
+    out = []
+    for i in range(3):
+        if hasattr(helpers, "maybe"):
+            out.append(helpers.maybe())
+        out.append(i)
+    return out
+
+print(cond())
+""",
+    "attribute rebound in the loop": """
+class Motor:
+    def __init__(self, name):
+        self.name = name
+    def run(self):
+        return self.name
+
+class Robot:
+    def __init__(self):
+        self.motor = Motor("A")
+    def swap(self):
+        self.motor = Motor("B")
+
+robot = Robot()
+
+def swapping():
+    res = []
+    for i in range(2):
+        res.append(robot.motor.run())
+        robot.swap()
+    return res
+
+print(swapping())
+""",
+    "global of another module rebound in the loop": """
+import helpers
+
+def rebinding():
+    res = []
+    for i in range(3):
+        res.append(helpers.value())
+        helpers.bump()
+    return res
+
+print(rebinding())
+""",
+    "loop that does not run": """
+def f(items):
+    out = []
+    for x in items:
+        out.append(later(x))
+    return out
+
+print(f([]))
+
+def later(x):
+    return x
+
+print(f([1, 2]))
+""",
+}
+
+
+def run(script: Path) -> str:
+    result = subprocess.run(
+        [sys.executable, script.name], cwd=script.parent, capture_output=True, text=True
+    )
+    if result.returncode:
+        raise AssertionError(f"{script.name} failed:\n{result.stderr}")
+    return result.stdout
+
+
+class HoistGlobalsTest(unittest.TestCase):
+    def test_output_unchanged(self):
+        for name, source in PROGRAMS.items():
+            with self.subTest(name), tempfile.TemporaryDirectory() as tmp:
+                project = Path(tmp)
+                (project / "helpers.py").write_text(HELPERS, encoding="utf-8")
+                (project / "main.py").write_text(source, encoding="utf-8")
+                sys.path.append(tmp)
+                try:
+                    with contextlib.chdir(project):
+                        bundle = ComPYner(hoist_globals=True).compyne_from_ast(
+                            "__main__", ast.parse(source), origin="main.py"
+                        )
+                finally:
+                    sys.path.remove(tmp)
+                    sys.modules.pop("helpers", None)
+                (project / "bundle.py").write_text(bundle, encoding="utf-8")
+                self.assertEqual(run(project / "bundle.py"), run(project / "main.py"))
+
+
+if __name__ == "__main__":
+    unittest.main()